@@ -0,0 +1,24 @@
+"""Add out-of-bag loss
+
+Revision ID: 5d1c7e94b0a3
+Revises: 2a37ab2f9992
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1c7e94b0a3'
+down_revision = '2a37ab2f9992'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('ml_models', sa.Column('oob_loss', sa.LargeBinary(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('ml_models', 'oob_loss')
@@ -0,0 +1,31 @@
+"""Add content-addressed datasets
+
+Revision ID: 8e4b2f61c9d7
+Revises: 5d1c7e94b0a3
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4b2f61c9d7'
+down_revision = '5d1c7e94b0a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'datasets',
+        sa.Column('hash', sa.String(), nullable=False),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('hash'),
+        sa.UniqueConstraint('path'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('datasets')
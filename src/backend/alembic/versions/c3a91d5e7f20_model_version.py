@@ -0,0 +1,24 @@
+"""Add model version of the artifact store
+
+Revision ID: c3a91d5e7f20
+Revises: 8e4b2f61c9d7
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a91d5e7f20'
+down_revision = '8e4b2f61c9d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('ml_models', sa.Column('model_version', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('ml_models', 'model_version')
@@ -0,0 +1,146 @@
+import os
+import uuid
+import pickle
+import shutil
+
+
+ARTIFACTS_DIR = 'storage/models'
+
+
+def _dump(obj, path: str) -> None:
+    """Pickle the object to a temporary file and rename it to the path"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def _load(path: str):
+    """Unpickle the object from the path"""
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def artifact_path(model_id, version: int) -> str:
+    """Return path of the serialized model with the given id and version"""
+    return os.path.join(ARTIFACTS_DIR, str(model_id), f'{version}.pkl')
+
+
+def save_model(model_id, version: int, model) -> str:
+    """
+    Serialize the model to the artifact store. The file is written to\\
+    a temporary location and renamed, so readers never see a partial model.\\
+    Every version is a complete model: a model grown with warm start is\\
+    serialized whole, including the trees stored by the previous version.
+
+    Parameters:
+    -------
+    - model_id: uuid of the model
+    - version: version of the model, incremented on every fit
+    - model: fitted ensemble
+
+    Returns:
+    -------
+    - path of the saved artifact
+    """
+    path = artifact_path(model_id, version)
+    _dump(model, path)
+    return path
+
+
+def copy_model(model_file: str, model_id, version: int) -> str:
+    """
+    Copy a serialized model to the artifact store as the given version of the\\
+    model, without deserializing it. Returns path of the saved artifact
+    """
+    path = artifact_path(model_id, version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    shutil.copyfile(model_file, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_model(model_id, version: int):
+    """Deserialize the model with the given id and version from the artifact store"""
+    return _load(artifact_path(model_id, version))
+
+
+def remove_model(model_id, version: int | None = None) -> None:
+    """
+    Remove a version of the model from the artifact store.\\
+    If version is None then all the versions are removed.
+    """
+    if version is None:
+        shutil.rmtree(os.path.join(ARTIFACTS_DIR, str(model_id)), ignore_errors=True)
+    elif os.path.exists(artifact_path(model_id, version)):
+        os.remove(artifact_path(model_id, version))
+
+
+def checkpoint_path(model_id) -> str:
+    """Return path of the checkpoint of the running fit of the model"""
+    return os.path.join(ARTIFACTS_DIR, str(model_id), 'checkpoint.pkl')
+
+
+def save_checkpoint(model_id, checkpoint: dict) -> None:
+    """
+    Save a partially fitted model to the artifact store, replacing the previous\\
+    checkpoint of the model.
+
+    Parameters:
+    -------
+    - model_id: uuid of the model
+    - checkpoint: dict with the partially fitted ensemble, its fit state,\\
+    staged losses so far and the id of the fitting task
+    """
+    _dump(checkpoint, checkpoint_path(model_id))
+
+
+def load_checkpoint(model_id) -> dict | None:
+    """Load the checkpoint of the model, returns None if there is no checkpoint"""
+    try:
+        return _load(checkpoint_path(model_id))
+    except FileNotFoundError:
+        return None
+
+
+def remove_checkpoint(model_id) -> None:
+    """Remove the checkpoint of the model if it exists"""
+    if os.path.exists(checkpoint_path(model_id)):
+        os.remove(checkpoint_path(model_id))
+
+
+def shard_path(model_id, shard: int) -> str:
+    """Return path of a shard of the model fitted in parallel"""
+    return os.path.join(ARTIFACTS_DIR, str(model_id), f'shard-{shard}.pkl')
+
+
+def save_shard(model_id, shard: int, result: dict) -> None:
+    """
+    Save a fitted shard of the model to the artifact store, where it is\\
+    merged with the other shards.
+
+    Parameters:
+    -------
+    - model_id: uuid of the model
+    - shard: number of the shard
+    - result: dict with the fitted forest of the shard, or with the id and\\
+        the number of deliveries of the shard\'s task while the shard is fitted
+    """
+    _dump(result, shard_path(model_id, shard))
+
+
+def load_shard(model_id, shard: int) -> dict | None:
+    """Load a shard of the model, returns None if there is no shard"""
+    try:
+        return _load(shard_path(model_id, shard))
+    except FileNotFoundError:
+        return None
+
+
+def remove_shards(model_id, shards: list[int]) -> None:
+    """Remove the fitted shards of the model"""
+    for shard in shards:
+        if os.path.exists(shard_path(model_id, shard)):
+            os.remove(shard_path(model_id, shard))
@@ -0,0 +1,91 @@
+import asyncio
+from typing import Hashable
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from settings import settings
+
+
+class _Batch:
+    """Rows of the pending requests to one model and the futures waiting for their predictions"""
+    def __init__(self, model) -> None:
+        self.model = model
+        self.rows: list[np.ndarray] = []
+        self.futures: list[asyncio.Future] = []
+        self.n_rows = 0
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class MicroBatcher:
+    def __init__(self, window: float, max_rows: int):
+        """
+        Coalesce concurrent prediction requests to the same model into one\\
+        vectorized `predict` call. The first request to a model opens a batch,\\
+        which is predicted when the window passes or it reaches max_rows rows.\\
+        Predictions run in the thread pool, so the event loop keeps accepting\\
+        requests meanwhile.
+
+        Parameters:
+        -------
+        - window: the time in seconds a batch waits for more requests
+        - max_rows: the number of rows to predict a batch at once
+        """
+        self._window = window
+        self._max_rows = max_rows
+        self._batches: dict[Hashable, _Batch] = {}
+        # references to running predictions, so they are not garbage collected
+        self._running: set[asyncio.Task] = set()
+
+    async def predict(self, key: Hashable, model, X: np.ndarray) -> np.ndarray:
+        """
+        Return predictions of the model for the rows, predicted together with\\
+        rows of other requests with the same key.
+
+        Parameters:
+        -------
+        - key: batch key, requests with the same key are predicted by the same model
+        - model: fitted ensemble
+        - X: array of size n_objects, n_features
+        """
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch(model)
+            batch.timer = loop.call_later(self._window, self._flush, key)
+
+        future = loop.create_future()
+        batch.rows.append(X)
+        batch.futures.append(future)
+        batch.n_rows += X.shape[0]
+        if batch.n_rows >= self._max_rows:
+            batch.timer.cancel()
+            self._flush(key)
+        return await future
+
+    def _flush(self, key: Hashable) -> None:
+        """Close the batch and start predicting it"""
+        batch = self._batches.pop(key)
+        task = asyncio.ensure_future(self._predict_batch(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    @staticmethod
+    async def _predict_batch(batch: _Batch) -> None:
+        """Predict all rows of the batch and pass every request its slice of predictions"""
+        try:
+            preds = await run_in_threadpool(batch.model.predict, np.concatenate(batch.rows))
+        except Exception as exc:  # every request of the batch gets the error
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        start = 0
+        for rows, future in zip(batch.rows, batch.futures):
+            if not future.done():
+                future.set_result(preds[start:start + rows.shape[0]])
+            start += rows.shape[0]
+
+
+scoring_batcher = MicroBatcher(settings.SCORING_BATCH_WINDOW_MS / 1000, settings.SCORING_MAX_BATCH_ROWS)
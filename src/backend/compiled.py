@@ -0,0 +1,124 @@
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed
+
+
+TREE_LEAF = -1
+
+
+def _tree_depth(children_left: np.ndarray, children_right: np.ndarray) -> int:
+    """Return the depth of the tree given by its children arrays"""
+    depth = 0
+    level = np.array([0])
+    while True:
+        level = level[children_left[level] != TREE_LEAF]
+        if level.shape[0] == 0:
+            return depth
+        level = np.concatenate([children_left[level], children_right[level]])
+        depth += 1
+
+
+class CompiledEnsemble:
+    def __init__(self,
+                 trees: Iterable[Tuple[object, np.ndarray, float]],
+                 batch_size: int = 1 << 20) -> None:
+        """
+        Pack the nodes of all trees of an ensemble into contiguous arrays\\
+        and predict with all trees at once in a single process.
+
+        Parameters
+        -------
+        - trees: iterable of (tree structure, used features, weight) tuples, where\\
+            the tree structure has sklearn `Tree` arrays `children_left`,\\
+            `children_right`, `feature`, `threshold`, `value` and optionally\\
+            `missing_go_to_left`, without it missing values go to the right.\\
+            Tree features index the used features array, weight is multiplied\\
+            by leaf values.
+        - batch_size: the maximum number of (sample, tree) pairs traversed at once.
+        """
+        children_left, children_right, feature, threshold, value, roots = [], [], [], [], [], []
+        missing_go_to_left = []
+        self._max_depth = 0
+        offset = 0
+        for tree, feature_idxs, weight in trees:
+            left = np.asarray(tree.children_left, dtype=np.intp)
+            right = np.asarray(tree.children_right, dtype=np.intp)
+            node_ids = np.arange(left.shape[0]) + offset
+            is_leaf = left == TREE_LEAF
+
+            # leaves point to themselves, so traversal can run for a fixed number of steps
+            children_left.append(np.where(is_leaf, node_ids, left + offset))
+            children_right.append(np.where(is_leaf, node_ids, right + offset))
+            feature.append(np.where(is_leaf, 0, np.asarray(feature_idxs)[np.maximum(tree.feature, 0)]))
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+            missing_left = getattr(tree, 'missing_go_to_left', None)
+            missing_go_to_left.append(
+                np.zeros(left.shape[0], dtype=bool) if missing_left is None else np.asarray(missing_left, dtype=bool)
+            )
+            value.append(weight * np.asarray(tree.value, dtype=np.float64).reshape(-1))
+            roots.append(offset)
+
+            self._max_depth = max(self._max_depth, _tree_depth(left, right))
+            offset += left.shape[0]
+
+        self._children_left = np.concatenate(children_left)
+        self._children_right = np.concatenate(children_right)
+        self._feature = np.concatenate(feature).astype(np.intp)
+        self._threshold = np.concatenate(threshold).astype(np.float64)
+        self._value = np.concatenate(value)
+        self._missing_go_to_left = np.concatenate(missing_go_to_left)
+        self._roots = np.array(roots, dtype=np.intp)
+        self._batch_size = batch_size
+
+    @property
+    def n_trees(self) -> int:
+        """The number of packed trees"""
+        return self._roots.shape[0]
+
+    def predict(self, X: np.ndarray, parallel: Optional[Parallel] = None) -> np.ndarray:
+        """
+        Parameters
+        -------
+        - X: array of size n_objects, n_features - the input samples
+        - parallel: thread pool to traverse row batches concurrently.\\
+            If None then batches are traversed one after another.
+
+        Returns
+        -------
+        - y: array of size n_objects - sum of weighted predictions of all trees
+        """
+        preds = np.zeros(X.shape[0], dtype=np.float64)
+        n_rows = max(1, self._batch_size // max(1, self.n_trees))
+        starts = range(0, X.shape[0], n_rows)
+        if parallel is None or len(starts) < 2:
+            batch_preds = (self._predict_batch(X[start:start + n_rows]) for start in starts)
+        else:
+            batch_preds = parallel(delayed(self._predict_batch)(X[start:start + n_rows]) for start in starts)
+
+        for start, batch_pred in zip(starts, batch_preds):
+            preds[start:start + n_rows] = batch_pred
+        return preds
+
+    def _predict_batch(self, X: np.ndarray) -> np.ndarray:
+        """Return sum of weighted predictions of all trees for a batch of samples"""
+        return self._leaf_values(X).sum(axis=1)
+
+    def _leaf_values(self, X: np.ndarray) -> np.ndarray:
+        """Return weighted leaf values of array of size n_objects, n_trees for a batch of samples"""
+        # trees compare features in float32
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        row_offsets = (np.arange(X.shape[0]) * X.shape[1])[:, None]
+        X_flat = X.ravel()
+
+        has_missing = np.isnan(X_flat).any()
+
+        nodes = np.broadcast_to(self._roots, (X.shape[0], self.n_trees))
+        for _ in range(self._max_depth):
+            values = X_flat[row_offsets + self._feature[nodes]]
+            goes_left = values <= self._threshold[nodes]
+            if has_missing:
+                # missing values follow the direction learned by the tree at every split
+                goes_left |= np.isnan(values) & self._missing_go_to_left[nodes]
+            nodes = np.where(goes_left, self._children_left[nodes], self._children_right[nodes])
+        return self._value[nodes]
@@ -1,16 +1,23 @@
-import pickle
-import time
-from uuid import UUID
+import os
+import json
+import shutil
+from typing import BinaryIO
+from uuid import UUID, uuid4
 
 import numpy as np
-import pandas as pd
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 
 import models
 import schemas
 import ensembles
+import datasets
+import artifacts
+import utils
+from model_cache import model_cache
+from settings import settings
 
 
 def get_object_or_404(func):
@@ -63,40 +70,213 @@ def read_model_names(db: Session) -> list:
 
 
 def delete_model(db: Session, uuid: UUID) -> None:
-    """Delete model with the given uuid from the \'ml_models\' table"""
-    return db.delete(read_model_item(db, uuid))
+    """
+    Delete model with the given uuid from the \'ml_models\' table and\\
+    release the datasets it was trained on.
+    """
+    db_item = read_model_item(db, uuid)
+    unused_paths = [
+        release_dataset(db, db_item.train_dataset_file_path),
+        release_dataset(db, db_item.val_dataset_file_path),
+    ]
+    db.delete(db_item)
+    try:
+        db.commit()
+    except Exception:
+        _restore_datasets(unused_paths)
+        raise
+
+    _remove_datasets(unused_paths)
+    model_cache.invalidate(db_item.id)
+    artifacts.remove_model(uuid)
+    utils.save_fit_state(uuid, None, '')
+
+
+def read_dataset(db: Session, dataset_hash: str) -> models.Dataset | None:
+    """Return the stored dataset with the given content hash from the \'datasets\' table"""
+    return db.query(models.Dataset).where(models.Dataset.hash == dataset_hash).first()
+
+
+def acquire_dataset(db: Session, dataset_hash: str, file: BinaryIO | None, target_name: str) -> str:
+    """
+    Add a reference to the stored dataset with the given content hash and\\
+    return its path. The uploaded file is streamed into the storage only if\\
+    the dataset is not stored yet. Changes are committed by the caller.
+
+    Parameters:
+    -------
+    - db: database session
+    - dataset_hash: hash of the uploaded file, see `utils.hash_upload`
+    - file: uploaded .csv file, may be None if the dataset is already stored
+    - target_name: target column name
+    """
+    db_dataset = db.query(models.Dataset).where(models.Dataset.hash == dataset_hash).with_for_update().first()
+    if db_dataset is None:
+        if file is None:
+            raise HTTPException(409, detail='Dataset was removed from the storage, upload it again')
+        db_dataset = models.Dataset(hash=dataset_hash, path=f'storage/datasets/{dataset_hash}', ref_count=0)
+        if not os.path.exists(db_dataset.path):
+            try:
+                datasets.ingest_csv(file, target_name, db_dataset.path, settings.INGEST_CHUNK_ROWS)
+            except ValueError as exc:
+                raise HTTPException(422, detail=f'Bad file format: {exc}') from exc
+        try:
+            # the same dataset may be added by a concurrent upload
+            with db.begin_nested():
+                db.add(db_dataset)
+        except IntegrityError:
+            db_dataset = db.query(models.Dataset).where(models.Dataset.hash == dataset_hash).with_for_update().one()
+
+    db_dataset.ref_count += 1
+    return db_dataset.path
+
+
+def release_dataset(db: Session, path: str | None) -> str | None:
+    """
+    Remove a reference to the stored dataset with the given path. A dataset\\
+    which is not referenced anymore is deleted, and its directory is renamed\\
+    while the record is locked, so a concurrent upload of the same dataset\\
+    stores it anew. Returns the renamed directory, which should be removed\\
+    from the storage after the commit, see `_remove_datasets`.
+    """
+    db_dataset = db.query(models.Dataset).where(models.Dataset.path == path).with_for_update().first()
+    if db_dataset is None:
+        return None
+
+    db_dataset.ref_count -= 1
+    if db_dataset.ref_count > 0:
+        return None
+    db.delete(db_dataset)
+    removed_path = f'{db_dataset.path}.{uuid4().hex}.removed'
+    try:
+        os.rename(db_dataset.path, removed_path)
+    except FileNotFoundError:
+        return None
+    return removed_path
+
+
+def _remove_datasets(paths: list) -> None:
+    """Remove unused datasets with their cached artifacts from the storage"""
+    for path in paths:
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _restore_datasets(paths: list) -> None:
+    """Move back datasets renamed by `release_dataset` if the transaction failed"""
+    for path in paths:
+        if path is not None:
+            os.rename(path, path.rsplit('.', 2)[0])
+
+
+def _save_model_version(db_item: models.MLModel,
+                        model: ensembles.RandomForestMSE | ensembles.GradientBoostingMSE | None,
+                        model_file: str | None) -> int | None:
+    """
+    Store the fitted model as the next version of the model in the artifact\\
+    store and point the record to it. The record is changed only after the\\
+    model is stored. Returns the previous version.
+    """
+    version = (db_item.model_version or 0) + 1
+    if model is not None:
+        artifacts.save_model(db_item.id, version, model)
+    else:
+        artifacts.copy_model(model_file, db_item.id, version)
+    prev_version, db_item.model_version = db_item.model_version, version
+    db_item.model_serialized = None
+    db_item.is_trained = True
+    return prev_version
+
+
+def _update_datasets(db: Session,
+                     db_item: models.MLModel,
+                     unused_paths: list,
+                     train_dataset_hash: str | None,
+                     train_file: BinaryIO | None,
+                     val_dataset_hash: str | None,
+                     val_file: BinaryIO | None) -> None:
+    """
+    Point the record to the datasets with the given content hashes, None hashes\\
+    are kept. Paths of the released datasets are appended to unused_paths.
+    """
+    for field, dataset_hash, file in [
+        ('train_dataset_file_path', train_dataset_hash, train_file),
+        ('val_dataset_file_path', val_dataset_hash, val_file),
+    ]:
+        if dataset_hash is not None:
+            path = acquire_dataset(db, dataset_hash, file, db_item.target_name)
+            unused_paths.append(release_dataset(db, getattr(db_item, field)))
+            setattr(db_item, field, path)
+
+
+def _update_fit_results(db_item: models.MLModel,
+                        is_trained: bool | None,
+                        n_estimators: int | None,
+                        **losses) -> None:
+    """Set the given fit results of the record, None values are kept"""
+    for field, loss in losses.items():
+        if loss is not None:
+            setattr(db_item, field, loss.tobytes())
+    if is_trained is not None:
+        db_item.is_trained = is_trained
+    if n_estimators is not None:
+        model_parameters = json.loads(db_item.model_parameters)
+        model_parameters['ensemble_params']['n_estimators'] = n_estimators
+        db_item.model_parameters = json.dumps(model_parameters)
 
 
 def update_model(db: Session,
                  uuid: UUID,
                  model: ensembles.RandomForestMSE | ensembles.GradientBoostingMSE | None = None,
+                 model_file: str | None = None,
                  target_name: str | None = None,
                  is_trained: bool | None = None,
-                 train_dataset: pd.DataFrame | None = None,
-                 val_dataset: pd.DataFrame | None = None,
+                 train_dataset_hash: str | None = None,
+                 train_file: BinaryIO | None = None,
+                 val_dataset_hash: str | None = None,
+                 val_file: BinaryIO | None = None,
                  train_loss: np.ndarray | None = None,
-                 val_loss: np.ndarray | None = None) -> models.MLModel:
-    """Update model\'s record with the given uuid."""
+                 val_loss: np.ndarray | None = None,
+                 oob_loss: np.ndarray | None = None,
+                 n_estimators: int | None = None) -> models.MLModel:
+    """
+    Update model\'s record with the given uuid. Datasets are identified by\\
+    the content hash, and their files may be omitted if they are already stored.\\
+    A fitted model is passed either as is or as model_file, the path of the\\
+    serialized model, which is copied to the artifact store. Each fit, warm\\
+    start included, stores a new complete version of the model, the trees\\
+    appended by a warm start are not persisted separately.
+    """
     db_item = read_model_item(db, uuid)
+    model_id = db_item.id
+    unused_paths = []
+    prev_version, new_version = None, None
 
-    if model is not None:
-        db_item.model_serialized = pickle.dumps(model)
-        db_item.is_trained = True
-    if train_dataset is not None:
-        db_item.train_dataset_file_path = f'storage/train/{time.perf_counter_ns()}.csv'
-        train_dataset.to_csv(db_item.train_dataset_file_path)
-    if val_dataset is not None:
-        db_item.val_dataset_file_path = f'storage/val/{time.perf_counter_ns()}.csv'
-        val_dataset.to_csv(db_item.val_dataset_file_path)
-    if target_name is not None:
-        db_item.target_name = target_name
-    if train_loss is not None:
-        db_item.train_loss = train_loss.tobytes()
-    if val_loss is not None:
-        db_item.val_loss = val_loss.tobytes()
-    if is_trained is not None:
-        db_item.is_trained = is_trained
+    try:
+        if model is not None or model_file is not None:
+            prev_version = _save_model_version(db_item, model, model_file)
+            new_version = db_item.model_version
+        if target_name is not None:
+            db_item.target_name = target_name
+        _update_datasets(db, db_item, unused_paths, train_dataset_hash, train_file, val_dataset_hash, val_file)
+        _update_fit_results(
+            db_item, is_trained, n_estimators,
+            train_loss=train_loss, val_loss=val_loss, oob_loss=oob_loss,
+        )
 
-    db.commit()
+        db.commit()
+    except Exception:
+        # released datasets are moved back while their records are still locked
+        _restore_datasets(unused_paths)
+        db.rollback()
+        if new_version is not None:
+            artifacts.remove_model(model_id, new_version)
+        raise
+    _remove_datasets(unused_paths)
+    if new_version is not None:
+        # other processes miss the cache on the new version
+        model_cache.invalidate(model_id)
+    if prev_version is not None:
+        artifacts.remove_model(model_id, prev_version)
     db.refresh(db_item)
     return db_item
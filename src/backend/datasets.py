@@ -0,0 +1,344 @@
+import os
+import json
+import uuid
+import shutil
+from typing import BinaryIO, Callable, Tuple
+
+import numpy as np
+import pandas as pd
+
+from histogram import HistogramBinner
+
+
+FEATURES_FILE = 'X.npy'
+TARGET_FILE = 'y.npy'
+SCHEMA_FILE = 'schema.json'
+STATS_FILE = 'stats.json'
+
+
+def load_dataset(directory: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return read-only memory-mapped features and the target of a stored dataset.
+
+    Parameters:
+    -------
+    - directory: dataset directory written by `ingest_csv`
+    """
+    X = np.load(os.path.join(directory, FEATURES_FILE), mmap_mode='r')
+    y = np.load(os.path.join(directory, TARGET_FILE))
+    return X, y
+
+
+def load_schema(directory: str) -> dict:
+    """Return the schema of a stored dataset"""
+    with open(os.path.join(directory, SCHEMA_FILE), encoding='utf-8') as file:
+        return json.load(file)
+
+
+def cached_array(directory: str, name: str, compute: Callable[[], np.ndarray]) -> np.ndarray:
+    """
+    Return a derived array cached alongside the stored dataset, computing and\\
+    saving it on the first call. Cached arrays are memory-mapped read-only.
+
+    Parameters:
+    -------
+    - directory: dataset directory
+    - name: name of the artifact, unique for the way it is computed
+    - compute: function computing the artifact
+    """
+    path = os.path.join(directory, f'{name}.npy')
+    if not os.path.exists(path):
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.save(file, compute())
+        os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r')
+
+
+def binned_features(directory: str, max_bins: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return features of a stored dataset quantized for histogram boosting and\\
+    the bin edges, cached for the number of bins.
+    """
+    X, _ = load_dataset(directory)
+    # named apart from the arrays cached before missing values had a bin of their own
+    bin_edges = cached_array(
+        directory,
+        f'bin_edges_{max_bins}_missing',
+        lambda: HistogramBinner(max_bins).fit(X).bin_edges,
+    )
+    binner = HistogramBinner(max_bins)
+    binner.bin_edges = np.asarray(bin_edges)
+    X_binned = cached_array(directory, f'X_binned_{max_bins}_missing', lambda: binner.transform(X))
+    return X_binned, binner.bin_edges
+
+
+class _ColumnStats:
+    """Running per-column statistics, updated with blocks of rows"""
+    def __init__(self, n_columns: int) -> None:
+        self._count = np.zeros(n_columns)
+        self._mean = np.zeros(n_columns)
+        self._m2 = np.zeros(n_columns)
+        self._min = np.full(n_columns, np.inf)
+        self._max = np.full(n_columns, -np.inf)
+        self._n_missing = np.zeros(n_columns, dtype=np.int64)
+
+    def update(self, block: np.ndarray) -> None:
+        """Add a block of size n_rows, n_columns, missing values are NaN"""
+        block = np.asarray(block, dtype=np.float64)
+        missing = np.isnan(block)
+        count = (~missing).sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, np.nansum(block, axis=0) / count, 0)
+            m2 = np.nansum(np.square(block - mean), axis=0)
+            # merge the block moments with the running ones
+            total = self._count + count
+            delta = mean - self._mean
+            self._mean = np.where(total > 0, self._mean + delta * count / total, 0)
+            self._m2 = self._m2 + m2 + np.where(total > 0, np.square(delta) * self._count * count / total, 0)
+        self._count = total
+        self._min = np.fmin(self._min, np.where(missing, np.inf, block).min(axis=0, initial=np.inf))
+        self._max = np.fmax(self._max, np.where(missing, -np.inf, block).max(axis=0, initial=-np.inf))
+        self._n_missing += missing.sum(axis=0)
+
+    def to_dict(self, names: list) -> dict:
+        """Return statistics of every column by its name"""
+        stats = {}
+        for i, name in enumerate(names):
+            present = self._count[i] > 0
+            stats[name] = {
+                'mean': float(self._mean[i]) if present else None,
+                'std': float(np.sqrt(self._m2[i] / self._count[i])) if present else None,
+                'min': float(self._min[i]) if present else None,
+                'max': float(self._max[i]) if present else None,
+                'n_missing': int(self._n_missing[i]),
+            }
+        return stats
+
+
+def _save_stats(directory: str, stats: dict) -> None:
+    """Atomically write per-column statistics of a stored dataset"""
+    path = os.path.join(directory, STATS_FILE)
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(stats, file)
+    os.replace(tmp_path, path)
+
+
+def column_stats(directory: str, chunksize: int = 100_000) -> dict:
+    """
+    Return per-column statistics of a stored dataset: mean, std, min, max and\\
+    the number of missing values, computed in blocks of rows and cached.
+    """
+    path = os.path.join(directory, STATS_FILE)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+
+    X, y = load_dataset(directory)
+    schema = load_schema(directory)
+    features_stats, target_stats = _ColumnStats(X.shape[1]), _ColumnStats(1)
+    for start in range(0, X.shape[0], chunksize):
+        features_stats.update(X[start:start + chunksize])
+        target_stats.update(y[start:start + chunksize, None])
+
+    stats = {
+        **features_stats.to_dict(schema['columns']),
+        **target_stats.to_dict([schema['target_name']]),
+    }
+    _save_stats(directory, stats)
+    return stats
+
+
+def _spill_csv(file: BinaryIO, target_name: str, tmp_directory: str, chunksize: int) -> tuple:
+    """
+    Read and validate a .csv file in chunks, spilling every chunk in column-major\\
+    order to scratch files of the features and the target in tmp_directory.\\
+    Returns feature columns, the number of rows of every chunk and column statistics.
+    """
+    chunk_rows, columns, stats = [], None, None
+    with open(os.path.join(tmp_directory, 'features.bin'), 'wb') as scratch, \
+            open(os.path.join(tmp_directory, 'target.bin'), 'wb') as target_scratch:
+        try:
+            for chunk in pd.read_csv(file, chunksize=chunksize):
+                if columns is None:
+                    if target_name not in chunk.columns:
+                        raise ValueError(f'target column {target_name} is not found')
+                    columns = chunk.columns.drop(target_name)
+                    stats = _ColumnStats(chunk.shape[1])
+                if chunk.select_dtypes(exclude='number').shape[1] > 0:
+                    raise ValueError('non-numeric columns')
+
+                scratch.write(chunk[columns].to_numpy(dtype=np.float32).tobytes(order='F'))
+                target_scratch.write(chunk[target_name].to_numpy(dtype=np.float64).tobytes())
+                stats.update(chunk[[*columns, target_name]].to_numpy(dtype=np.float64))
+                chunk_rows.append(chunk.shape[0])
+        except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as exc:
+            raise ValueError(str(exc)) from exc
+    if columns is None:
+        raise ValueError('empty file')
+    return columns, chunk_rows, stats
+
+
+def _write_features(tmp_directory: str, chunk_rows: list, n_columns: int) -> None:
+    """Copy spilled chunks column by column into the column-major features file"""
+    scratch_path = os.path.join(tmp_directory, 'features.bin')
+    n_rows = sum(chunk_rows)
+    X = np.lib.format.open_memmap(
+        os.path.join(tmp_directory, FEATURES_FILE),
+        mode='w+',
+        dtype=np.float32,
+        shape=(n_rows, n_columns),
+        fortran_order=True,
+    )
+    scratch = np.memmap(scratch_path, dtype=np.float32, mode='r', shape=(n_rows * n_columns,))
+    chunk_offset, row_start = 0, 0
+    for rows in chunk_rows:
+        for i in range(n_columns):
+            start = chunk_offset + i * rows
+            X[row_start:row_start + rows, i] = scratch[start:start + rows]
+        chunk_offset += rows * n_columns
+        row_start += rows
+    X.flush()
+    del X, scratch
+    os.remove(scratch_path)
+
+
+def _write_target(tmp_directory: str, n_rows: int) -> None:
+    """Copy the spilled target into the target file"""
+    target_scratch_path = os.path.join(tmp_directory, 'target.bin')
+    y = np.lib.format.open_memmap(
+        os.path.join(tmp_directory, TARGET_FILE),
+        mode='w+',
+        dtype=np.float64,
+        shape=(n_rows,),
+    )
+    y[:] = np.memmap(target_scratch_path, dtype=np.float64, mode='r', shape=(n_rows,))
+    y.flush()
+    del y
+    os.remove(target_scratch_path)
+
+
+def ingest_csv(file: BinaryIO, target_name: str, directory: str, chunksize: int = 100_000) -> dict:
+    """
+    Stream a .csv file into the binary dataset store, reading and validating\\
+    it in chunks of rows, so memory use does not depend on the file size.\\
+    Chunks are spilled to a scratch file and then copied column by column\\
+    into the column-major features file. Column statistics are collected\\
+    on the way and cached, see `column_stats`.
+
+    Parameters:
+    -------
+    - file: binary file object with the .csv contents
+    - target_name: target column name
+    - directory: dataset directory to create
+    - chunksize: the number of rows held in memory at once
+
+    Returns:
+    -------
+    - schema of the saved dataset
+
+    Raises:
+    -------
+    - ValueError: if the file can not be parsed, the target column is missing\\
+        or some column is not numeric
+    """
+    tmp_directory = f'{directory}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp_directory)
+    try:
+        columns, chunk_rows, stats = _spill_csv(file, target_name, tmp_directory, chunksize)
+        _write_features(tmp_directory, chunk_rows, columns.shape[0])
+        _write_target(tmp_directory, sum(chunk_rows))
+        schema = {
+            'target_name': target_name,
+            'columns': list(columns),
+            'n_rows': sum(chunk_rows),
+        }
+        with open(os.path.join(tmp_directory, SCHEMA_FILE), 'w', encoding='utf-8') as schema_file:
+            json.dump(schema, schema_file)
+        _save_stats(tmp_directory, stats.to_dict([*columns, target_name]))
+    except BaseException:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        raise
+
+    try:
+        os.replace(tmp_directory, directory)
+    except OSError:
+        # stored datasets are named by the hash of their content, so the directory
+        # written by a concurrent upload of the same file holds the same dataset
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        if not os.path.isdir(directory):
+            raise
+    return schema
+
+
+def memmap_paths(csv_path: str) -> Tuple[str, str]:
+    """Return paths of the memory-mapped features and target converted from the .csv file"""
+    base_path, _ = os.path.splitext(csv_path)
+    return f'{base_path}.X.npy', f'{base_path}.y.npy'
+
+
+def csv_to_memmap(csv_path: str, target_name: str, chunksize: int = 100_000) -> Tuple[str, str]:
+    """
+    Convert a .csv dataset into a column-major float32 features array and\\
+    a target array stored in .npy files, reading the file in chunks. The\\
+    conversion is skipped if the files already exist.
+
+    Parameters:
+    -------
+    - csv_path: path to the .csv file
+    - target_name: target column name
+    - chunksize: the number of rows held in memory at once
+
+    Returns:
+    -------
+    - paths to the features and target .npy files
+    """
+    X_path, y_path = memmap_paths(csv_path)
+    if os.path.exists(X_path) and os.path.exists(y_path):
+        return X_path, y_path
+
+    # the first pass reads the target only, to find out the number of rows
+    y = np.concatenate([
+        chunk[target_name].to_numpy(dtype=np.float64)
+        for chunk in pd.read_csv(csv_path, usecols=[target_name], chunksize=chunksize)
+    ])
+    columns = pd.read_csv(csv_path, nrows=0).columns.drop(target_name)
+
+    # write to temporary files first, so an interrupted conversion is not reused,
+    # concurrent conversions of the same file write to their own temporary files
+    suffix = uuid.uuid4().hex
+    X_tmp_path, y_tmp_path = f'{X_path}.{suffix}.tmp', f'{y_path}.{suffix}.tmp'
+    X = np.lib.format.open_memmap(
+        X_tmp_path,
+        mode='w+',
+        dtype=np.float32,
+        shape=(y.shape[0], columns.shape[0]),
+        fortran_order=True,
+    )
+    start = 0
+    for chunk in pd.read_csv(csv_path, usecols=list(columns), chunksize=chunksize):
+        X[start:start + chunk.shape[0]] = chunk[columns].to_numpy(dtype=np.float32)
+        start += chunk.shape[0]
+    X.flush()
+    del X
+
+    with open(y_tmp_path, 'wb') as file:
+        np.save(file, y)
+    os.replace(X_tmp_path, X_path)
+    os.replace(y_tmp_path, y_path)
+    return X_path, y_path
+
+
+def load_memmap(csv_path: str, target_name: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return read-only memory-mapped features and the target of a .csv dataset,\\
+    converting it on the first call.
+
+    Parameters:
+    -------
+    - csv_path: path to the .csv file
+    - target_name: target column name
+    """
+    X_path, y_path = csv_to_memmap(csv_path, target_name)
+    return np.load(X_path, mmap_mode='r'), np.load(y_path)
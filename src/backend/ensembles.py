@@ -1,17 +1,281 @@
-from typing import Optional, Tuple
-from joblib import Parallel, delayed
+import abc
+import copy
+import time
+import warnings
+from typing import Callable, Optional, Tuple
+from joblib import delayed
 
 import numpy as np
 
 from scipy.optimize import minimize_scalar
 from sklearn.tree import DecisionTreeRegressor
 
+from compiled import CompiledEnsemble
+from histogram import HistogramBinner, HistogramTreeRegressor
+from parallel import parallel_pool, validate_backend
+
+
+def _matches(preds: Optional[np.ndarray], X: np.ndarray) -> bool:
+    """Check that stored predictions correspond to the samples"""
+    return preds is not None and preds.shape == (X.shape[0],)
+
+
+def _report_stage(callback: Optional[Callable[[dict], Optional[bool]]],
+                  start_time: float,
+                  stage: int,
+                  n_estimators: int,
+                  train_loss: float,
+                  val_loss: Optional[float],
+                  oob_loss: Optional[float] = None) -> bool:
+    """Pass the progress of the fit to the callback, return True if fitting should stop"""
+    if callback is None:
+        return False
+    return bool(callback({
+        'stage': stage,
+        'n_estimators': n_estimators,
+        'elapsed': time.perf_counter() - start_time,
+        'train_loss': float(train_loss),
+        'val_loss': None if val_loss is None else float(val_loss),
+        'oob_loss': None if oob_loss is None else float(oob_loss),
+    }))
+
+
+def _draw_forest_subsamples(rng: np.random.Generator,
+                            n_samples: int,
+                            n_features: int,
+                            feature_subsample_size: float,
+                            bagging_size: float) -> tuple:
+    """Draw the features of a random forest tree and counts of its bagged train samples"""
+    # choose subsample of features for the current estimator
+    ftr_subsample_size = int(feature_subsample_size * n_features)
+    ftrs_subsample = rng.choice(
+        np.arange(n_features),
+        size=ftr_subsample_size,
+        replace=False
+    )
+
+    # choose subsample of training samples (bagging), passed as sample counts
+    # to the tree, which is equivalent to repeating the samples
+    smpl_subsample_size = int(bagging_size * n_samples)
+    smpls_subsample = rng.integers(n_samples, size=smpl_subsample_size)
+    sample_weight = np.bincount(smpls_subsample, minlength=n_samples).astype(np.float64)
+    return ftrs_subsample, sample_weight
+
+
+def _fit_forest_tree(X: np.ndarray,
+                     y: np.ndarray,
+                     X_val: Optional[np.ndarray],
+                     tree_params: dict,
+                     feature_subsample_size: float,
+                     bagging_size: float,
+                     seed: np.random.SeedSequence) -> tuple:
+    """
+    Fit a single tree of a random forest with feature selection and bagging.
+    Returns the fitted (tree, used features) with its predictions on train and validation\
+    samples and the mask of out-of-bag train samples. A module-level function, so workers\
+    of the processes backend receive only the data and the parameters of the tree
+    """
+    rng = np.random.default_rng(seed)
+    ftrs_subsample, sample_weight = _draw_forest_subsamples(
+        rng, X.shape[0], X.shape[1], feature_subsample_size, bagging_size,
+    )
+
+    # the only copy is the float32 feature subset, the tree uses it as is
+    X_sub = X[:, ftrs_subsample]
+
+    estimator = DecisionTreeRegressor(**{**tree_params, 'random_state': int(rng.integers(2 ** 31))})
+    estimator.fit(X_sub, y, sample_weight=sample_weight)
+
+    train_pred = estimator.predict(X_sub)
+    val_pred = None if X_val is None else estimator.predict(X_val[:, ftrs_subsample])
+    return (estimator, ftrs_subsample), train_pred, val_pred, sample_weight == 0
+
+
+def _replay_forest_tree(X: np.ndarray,
+                        X_val: Optional[np.ndarray],
+                        model: tuple,
+                        feature_subsample_size: float,
+                        bagging_size: float,
+                        seed: np.random.SeedSequence) -> tuple:
+    """
+    Return predictions of a fitted random forest tree on train and validation samples\
+    and the mask of its out-of-bag train samples, which is drawn again from the seed\
+    the tree was fitted from, see `_fit_forest_tree`
+    """
+    estimator, ftrs = model
+    ftrs_subsample, sample_weight = _draw_forest_subsamples(
+        np.random.default_rng(seed), X.shape[0], X.shape[1], feature_subsample_size, bagging_size,
+    )
+    if not np.array_equal(ftrs_subsample, ftrs):
+        raise ValueError('The tree was not fitted from the given seed')
+
+    train_pred = estimator.predict(X[:, ftrs])
+    val_pred = None if X_val is None else estimator.predict(X_val[:, ftrs])
+    return train_pred, val_pred, sample_weight == 0
+
+
+class _EarlyStopping:
+    def __init__(self, n_iter_no_change: Optional[int], tol: float) -> None:
+        """
+        Track validation loss and decide when fitting should stop.
+
+        Parameters
+        -------
+        - n_iter_no_change: the number of stages without improvement to stop after.\\
+            If None then never stop.
+        - tol: the minimal decrease of the loss to count as an improvement.
+        """
+        self._n_iter_no_change = n_iter_no_change
+        self._tol = tol
+        self._best_loss = np.inf
+        self._n_no_change = 0
+        self.best_stage = None  # the number of stages with the best loss
+
+    def update(self, loss: float, stage: int) -> bool:
+        """Register the loss of the given stage, return True if fitting should stop"""
+        if loss < self._best_loss - self._tol:
+            self._best_loss = loss
+            self.best_stage = stage
+            self._n_no_change = 0
+        else:
+            self._n_no_change += 1
+        return self._n_iter_no_change is not None and self._n_no_change >= self._n_iter_no_change
+
+
+class _BaseEnsemble(abc.ABC):
+    """
+    Fitting bookkeeping and prediction shared by the ensembles. Subclasses\
+    store fitted stages in self._models and pack them with `_compile`
+    """
+    # attributes added since the first release with the values older models behave as,
+    # models pickled before get them on unpickling
+    _STATE_DEFAULTS = {
+        '_n_iter_no_change': None,
+        '_tol': 1e-4,
+        '_n_jobs': -1,
+        '_backend': 'threads',
+        '_compiled': None,
+        '_fit_state': None,
+    }
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Parameters
+        -------
+        - X: array of size n_objects, n_features - the input samples
+
+        Returns
+        -------
+        - y: array of size n_objects - predicted values for each input sample
+        """
+        if self._models is None:
+            raise RuntimeError('The model is not fitted. run .fit() first.')
+
+        return self._predict_compiled(X)
+
+    def _truncate(self, early_stopping: _EarlyStopping, n_prev: int, *losses: list) -> tuple:
+        """
+        Truncate the ensemble and staged losses of the stages after n_prev to the best\
+        stage if early stopping is used. Empty losses are returned as None
+        """
+        n_stages = len(self._models)
+        if self._n_iter_no_change is not None and early_stopping.best_stage is not None:
+            n_stages = early_stopping.best_stage
+        self._models = self._models[:n_stages]
+
+        return tuple(np.array(loss[:n_stages - n_prev]) if loss else None for loss in losses)
+
+    def _n_warm_start_trees(self, warm_start: bool) -> int:
+        """Return the number of fitted trees to keep when fitting"""
+        if not warm_start or not self._models:
+            return 0
+        if self._n_estimators < len(self._models):
+            raise ValueError(
+                f'n_estimators={self._n_estimators} must be at least the number '
+                f'of fitted trees {len(self._models)} when warm starting'
+            )
+        return len(self._models)
+
+    @property
+    def n_estimators(self) -> int:
+        """The number of trees to fit, can be increased to add trees with warm start"""
+        return self._n_estimators
+
+    @n_estimators.setter
+    def n_estimators(self, n_estimators: int) -> None:
+        self._n_estimators = n_estimators
+
+    @property
+    def n_jobs(self) -> int:
+        """The number of workers, can be changed to run an unpickled model with another CPU budget"""
+        return self._n_jobs
+
+    @n_jobs.setter
+    def n_jobs(self, n_jobs: int) -> None:
+        self._n_jobs = n_jobs
+
+    @property
+    def fit_state(self) -> Optional[dict]:
+        """
+        Running predictions of the last fit on its train and validation data,\
+        used to warm start without a prediction pass. During a fit, predictions\
+        of the stages fitted so far, so a callback can checkpoint the ensemble.\
+        Not pickled with the model
+        """
+        return getattr(self, '_fit_state', None)
+
+    @fit_state.setter
+    def fit_state(self, fit_state: Optional[dict]) -> None:
+        self._fit_state = fit_state
+
+    def _predict_compiled(self, X: np.ndarray) -> np.ndarray:
+        """Predict with the flat-array predictor, spreading row batches over the thread pool"""
+        if self._backend != 'threads':
+            # processes would receive a pickled copy of all the trees with every batch
+            return self._get_compiled().predict(X)
+        with parallel_pool(self._backend, self._n_jobs) as parallel:
+            return self._get_compiled().predict(X, parallel)
+
+    def _get_compiled(self) -> CompiledEnsemble:
+        """Return the flat-array predictor, building it if it was dropped on pickling"""
+        if getattr(self, '_compiled', None) is None:
+            self._compiled = self._compile()
+        return self._compiled
+
+    def __getstate__(self):
+        # the compiled predictor duplicates the trees, so it is rebuilt after unpickling,
+        # fit state has the size of the train data and is saved separately
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        state['_fit_state'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(self._STATE_DEFAULTS)
+        self.__dict__.update(state)
+
+    @abc.abstractmethod
+    def _compile(self) -> CompiledEnsemble:
+        """Pack fitted stages into a flat-array predictor"""
+
+
+class RandomForestMSE(_BaseEnsemble):
+    _STATE_DEFAULTS = {
+        **_BaseEnsemble._STATE_DEFAULTS,
+        '_oob_loss': None,
+        '_random_state': None,
+        '_seed_sequence': None,
+    }
 
-class RandomForestMSE:
     def __init__(self,
                  n_estimators: int,
                  max_depth: Optional[int] = None,
                  feature_subsample_size: Optional[float] = None,
+                 n_iter_no_change: Optional[int] = None,
+                 tol: float = 1e-4,
+                 n_jobs: int = -1,
+                 backend: str = 'threads',
+                 random_state: Optional[int | np.random.SeedSequence] = None,
                  **trees_parameters) -> None:
         """
         Parameters
@@ -21,21 +285,44 @@ class RandomForestMSE:
             If None then there is no limits.
         - feature_subsample_size: the size of feature set for each tree.\\
             If None then use one-third of all features.
+        - n_iter_no_change: stop fitting when validation loss has not improved\\
+            for this number of trees. If None or no validation data passed,\\
+            then all the trees are built.
+        - tol: the minimal decrease of validation loss to count as an improvement.
+        - n_jobs: the number of workers fitting trees and predicting row batches.\\
+            -1 means all the cores.
+        - backend: 'threads', 'processes' or 'sequential'. sklearn trees release\\
+            the GIL while fitting, so threads avoid copying data to processes.
+        - random_state: seed of the forest, every tree gets its own random stream\\
+            spawned from it. A SeedSequence is used as is, so forests fitted in\\
+            parallel from spawned sequences have independent trees. If None then\\
+            the seed is drawn from the global numpy generator.
         """
         self._n_estimators = n_estimators
         self._max_depth = max_depth
         self._feature_subsample_size = feature_subsample_size
         if self._feature_subsample_size is None:
             self._feature_subsample_size = 0.33
+        self._n_iter_no_change = n_iter_no_change
+        self._tol = tol
+        self._n_jobs = n_jobs
+        self._backend = validate_backend(backend)
         self._tree_params = trees_parameters
         self._bagging_size = 1 - 1 / np.e
         self._models = None  # stores a tuple of (model, used features)
+        self._oob_loss = None
+        self._compiled = None  # flat-array predictor, built from self._models
+        self._fit_state = None  # running predictions of the last fit
+        self._random_state = random_state
+        self._seed_sequence = random_state if isinstance(random_state, np.random.SeedSequence) else None
 
     def fit(self,
             X: np.ndarray,
             y: np.ndarray,
             X_val: Optional[np.ndarray] = None,
-            y_val: Optional[np.ndarray] = None) -> None:
+            y_val: Optional[np.ndarray] = None,
+            warm_start: bool = False,
+            callback: Optional[Callable[[dict], Optional[bool]]] = None) -> None:
         """
         Parameters
         -------
@@ -43,77 +330,207 @@ class RandomForestMSE:
         - y: array of size n_objects containing train targets
         - X_val: array of size n_val_objects, n_features
         - y_val: array of size n_val_objects
+        - warm_start: keep already fitted trees and add new ones up to n_estimators.\\
+            Returned losses cover the added trees only.
+        - callback: function called after every tree with a dict of 'stage' (the number\\
+            of trees), 'n_estimators', 'elapsed' seconds and the current 'train_loss',\\
+            'val_loss' and 'oob_loss'. If it returns True, fitting stops after this tree.
         """
-        # initialize estimators
-        models = []
-        for _ in range(self._n_estimators):
-            estimator = DecisionTreeRegressor(
-                criterion='squared_error',
-                max_depth=self._max_depth,
-                **self._tree_params,
+        start_time = time.perf_counter()
+        n_prev = self._n_warm_start_trees(warm_start)
+
+        # trees are fit on float32 anyway, convert once to the column-major layout,
+        # so column subsets are contiguous and workers share a single read-only memmap
+        X = np.asfortranarray(X, dtype=np.float32)
+
+        # fit estimators, the staged losses are accumulated as the trees are ready
+        self._models = self._models[:n_prev] if n_prev else []
+        state = self._resume_state(X, X_val)
+        train_preds, val_preds = state['train_preds'], state['val_preds']
+        oob_preds, oob_counts = state['oob_preds'], state['oob_counts']
+        self._fit_state = state  # the sums are updated in place as the trees are added
+        train_loss, val_loss, oob_loss = [], [], []
+        early_stopping = _EarlyStopping(self._n_iter_no_change, self._tol)
+        if n_prev and X_val is not None:
+            early_stopping.update(np.mean(np.square(val_preds / n_prev - y_val)), n_prev)
+
+        # workers get only what a tree needs, not the forest with its fitted trees
+        tree_params = {'criterion': 'squared_error', 'max_depth': self._max_depth, **self._tree_params}
+        with parallel_pool(self._backend, self._n_jobs) as parallel:
+            results = parallel(
+                delayed(_fit_forest_tree)(
+                    X, y, X_val, tree_params, self._feature_subsample_size, self._bagging_size, seed,
+                ) for seed in self._spawn_seeds(self._n_estimators - n_prev)
             )
-            models.append(estimator)
-
-        # fit estimators
-        self._models = Parallel(n_jobs=-1)(
-            delayed(self._fit_estimator)(X, y, model) for model in models
-        )
-
-        train_loss = self._calc_loss(X, y)
-
-        val_loss = None
-        if X_val is not None:
-            val_loss = self._calc_loss(X_val, y_val)
+            for model, train_pred, val_pred, oob_mask in results:
+                self._models.append(model)
+
+                # running mean of the trees' predictions
+                train_preds += train_pred
+                train_loss.append(np.mean(np.square(train_preds / len(self._models) - y)))
+
+                # running mean over the trees which have not seen the sample
+                oob_preds += np.where(oob_mask, train_pred, 0)
+                oob_counts += oob_mask
+                has_oob = oob_counts > 0
+                oob_loss.append(np.mean(np.square(oob_preds[has_oob] / oob_counts[has_oob] - y[has_oob])))
+                stop = False
+                if X_val is not None:
+                    val_preds += val_pred
+                    val_loss.append(np.mean(np.square(val_preds / len(self._models) - y_val)))
+                    stop = early_stopping.update(val_loss[-1], len(self._models))
+                if _report_stage(
+                    callback, start_time, len(self._models), self._n_estimators,
+                    train_loss[-1], val_loss[-1] if val_loss else None, oob_loss[-1],
+                ) or stop:
+                    break
+
+            # cancel the trees left after early stopping
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', UserWarning)
+                results.close()
+
+        n_fitted = len(self._models)
+        train_loss, val_loss, self._oob_loss = self._truncate(early_stopping, n_prev, train_loss, val_loss, oob_loss)
+        self._fit_state = None
+        if len(self._models) == n_fitted:
+            self._fit_state = {
+                'train_preds': train_preds,
+                'val_preds': val_preds,
+                'oob_preds': oob_preds,
+                'oob_counts': oob_counts,
+            }
+        self._compiled = self._compile()
 
         return train_loss, val_loss
 
-    def predict(self, X: np.ndarray) -> np.ndarray:
+    @property
+    def oob_loss(self) -> Optional[np.ndarray]:
+        """Out-of-bag loss on each iteration of the last fit"""
+        return self._oob_loss
+
+    @classmethod
+    def merge(cls,
+              shards: list['RandomForestMSE'],
+              X: np.ndarray,
+              y: np.ndarray,
+              X_val: Optional[np.ndarray] = None,
+              y_val: Optional[np.ndarray] = None) -> tuple:
         """
+        Merge forests fitted in parallel on the same data into one forest.
+        The trees of the merged forest are predicted one by one, and their out-of-bag\
+        samples are drawn again from their seeds, so the staged losses of the merged\
+        forest and its fit state for warm start are exact.
+
         Parameters
         -------
-        - X: array of size n_objects, n_features - the input samples
+        - shards: forests fitted from scratch on the same data with independent seeds
+        - X: array of size n_objects, n_features containing train samples
+        - y: array of size n_objects containing train targets
+        - X_val: array of size n_val_objects, n_features
+        - y_val: array of size n_val_objects
 
         Returns
         -------
-        - y: array of size n_objects - predicted values for each input sample
+        - the merged forest, its staged train and validation losses
         """
-        if self._models is None:
-            raise RuntimeError('The model is not fitted. run .fit() first.')
-
-        preds = Parallel(n_jobs=-1)(
-            delayed(self._run_estimator)(X, model) for model in self._models
+        merged = copy.copy(shards[0])
+        merged._models = [model for shard in shards for model in shard._models]
+        merged._n_estimators = len(merged._models)
+        merged._compiled = merged._compile()
+
+        X = np.asfortranarray(X, dtype=np.float32)
+        state = {
+            'train_preds': np.zeros(X.shape[0]),
+            'val_preds': None if X_val is None else np.zeros(X_val.shape[0]),
+            'oob_preds': np.zeros(X.shape[0]),
+            'oob_counts': np.zeros(X.shape[0], dtype=np.int64),
+        }
+        train_loss, val_loss, oob_loss = [], [], []
+        seeds = [seed for shard in shards for seed in shard._tree_seeds()]
+        with parallel_pool(merged._backend, merged._n_jobs) as parallel:
+            results = parallel(
+                delayed(_replay_forest_tree)(
+                    X, X_val, model, merged._feature_subsample_size, merged._bagging_size, seed,
+                ) for model, seed in zip(merged._models, seeds)
+            )
+            for stage, (train_pred, val_pred, oob_mask) in enumerate(results, start=1):
+                state['train_preds'] += train_pred
+                train_loss.append(np.mean(np.square(state['train_preds'] / stage - y)))
+                state['oob_preds'] += np.where(oob_mask, train_pred, 0)
+                state['oob_counts'] += oob_mask
+                has_oob = state['oob_counts'] > 0
+                oob_loss.append(np.mean(np.square(
+                    state['oob_preds'][has_oob] / state['oob_counts'][has_oob] - y[has_oob]
+                )))
+                if X_val is not None:
+                    state['val_preds'] += val_pred
+                    val_loss.append(np.mean(np.square(state['val_preds'] / stage - y_val)))
+
+        merged._fit_state = state
+        train_loss, val_loss, merged._oob_loss = (
+            np.array(loss) if loss else None for loss in [train_loss, val_loss, oob_loss]
         )
-        return np.mean(preds, axis=0)
+        return merged, train_loss, val_loss
 
-    def _fit_estimator(
-            self,
-            X: np.ndarray,
-            y: np.ndarray,
-            estimator: DecisionTreeRegressor):
+    def _tree_seeds(self) -> list[np.random.SeedSequence]:
         """
-        Perform fitting of a single estimator with feature selection and bagging
+        Return seeds of the fitted trees. The trees are assumed to be fitted from\
+        scratch, so their seeds are the first ones spawned from the seed of the forest
         """
-        # choose subsample of features for the current estimator
-        ftr_subsample_size = int(self._feature_subsample_size * X.shape[1])
-        ftrs_subsample = np.random.choice(
-            np.arange(X.shape[1]),
-            size=ftr_subsample_size,
-            replace=False
-        )
-
-        # choose subsample of training samples (bagging)
-        smpl_subsample_size = int(self._bagging_size * X.shape[0])
-        smpls_subsample = np.random.choice(
-            np.arange(X.shape[0]),
-            size=smpl_subsample_size,
-            replace=True
-        )
+        return [
+            np.random.SeedSequence(
+                self._seed_sequence.entropy,
+                spawn_key=(*self._seed_sequence.spawn_key, i),
+                pool_size=self._seed_sequence.pool_size,
+            )
+            for i in range(len(self._models))
+        ]
 
-        X_sub = X[smpls_subsample][:, ftrs_subsample]
-        y_sub = y[smpls_subsample]
+    def _spawn_seeds(self, n_seeds: int) -> list[np.random.SeedSequence]:
+        """
+        Return independent seeds of the next trees. Seeds are spawned from the seed\
+        of the forest, which keeps count of them, so trees added with warm start\
+        do not repeat the random streams of fitted ones
+        """
+        if getattr(self, '_seed_sequence', None) is None:
+            random_state = getattr(self, '_random_state', None)
+            self._seed_sequence = np.random.SeedSequence(
+                np.random.randint(2 ** 31) if random_state is None else random_state
+            )
+        return self._seed_sequence.spawn(n_seeds)
 
-        estimator.fit(X_sub, y_sub)
-        return estimator, ftrs_subsample
+    def _resume_state(self, X: np.ndarray, X_val: Optional[np.ndarray]) -> dict:
+        """
+        Return running sums of the fitted trees' predictions to continue fitting from.
+        The sums are taken from the last fit if it was on the same data, otherwise\
+        recomputed, in which case out-of-bag statistics start from the new trees
+        """
+        state = {
+            'train_preds': np.zeros(X.shape[0]),
+            'val_preds': None if X_val is None else np.zeros(X_val.shape[0]),
+            'oob_preds': np.zeros(X.shape[0]),
+            'oob_counts': np.zeros(X.shape[0]),
+        }
+        if not self._models:
+            return state
+
+        n_prev = len(self._models)
+        fit_state = self.fit_state or {}
+        if _matches(fit_state.get('train_preds'), X):
+            state.update(fit_state)
+        else:
+            state['train_preds'] = self._predict_compiled(X) * n_prev
+        if X_val is not None and not _matches(fit_state.get('val_preds'), X_val):
+            state['val_preds'] = self._predict_compiled(X_val) * n_prev
+        return {key: None if value is None else np.array(value, dtype=np.float64) for key, value in state.items()}
+
+    def _compile(self) -> CompiledEnsemble:
+        """Pack fitted trees into a flat-array predictor averaging all trees"""
+        return CompiledEnsemble(
+            (estimator.tree_, ftrs_subsample, 1 / len(self._models))
+            for estimator, ftrs_subsample in self._models
+        )
 
     def _run_estimator(self,
                        X: np.ndarray,
@@ -128,24 +545,27 @@ class RandomForestMSE:
         estimator, feature_idxs = estimator
         return estimator.predict(X[:, feature_idxs])
 
-    def _calc_loss(self, X: np.ndarray, y: np.ndarray):
-        """
-        Calculate loss on each iteration of fitting the model.
-        """
-        preds = Parallel(n_jobs=-1)(
-            delayed(self._run_estimator)(X, model) for model in self._models
-        )
-        preds = np.cumsum(preds, axis=0).T / (1 + np.arange(self._n_estimators))
-        loss = np.mean(np.square(preds.T - y), axis=1)
-        return loss
 
+class GradientBoostingMSE(_BaseEnsemble):
+    _STATE_DEFAULTS = {
+        **_BaseEnsemble._STATE_DEFAULTS,
+        '_subsample': 1.0,
+        '_tree_method': 'exact',
+        '_max_bins': 255,
+    }
 
-class GradientBoostingMSE:
     def __init__(self,
                  n_estimators: int,
                  learning_rate: float = 0.1,
                  max_depth: int = 5,
                  feature_subsample_size: Optional[float] = None,
+                 subsample: float = 1.0,
+                 tree_method: str = 'exact',
+                 max_bins: int = 255,
+                 n_iter_no_change: Optional[int] = None,
+                 tol: float = 1e-4,
+                 n_jobs: int = -1,
+                 backend: str = 'threads',
                  **trees_parameters) -> None:
         """
         Parameters
@@ -156,21 +576,49 @@ class GradientBoostingMSE:
             If None then there is no limits.
         - feature_subsample_size : The size of feature set for each tree.\\
             If None then use one-third of all features.
+        - subsample: The fraction of samples to fit each tree and its step size on,\\
+            drawn without replacement for every stage.
+        - tree_method: 'exact' fits sklearn trees on raw features, 'hist' quantizes\\
+            features once per fit and finds splits from gradient histograms.
+        - max_bins: The maximum number of bins per feature in 'hist' mode.
+        - n_iter_no_change: Stop fitting when validation loss has not improved\\
+            for this number of stages. If None or no validation data passed,\\
+            then all the stages are built.
+        - tol: The minimal decrease of validation loss to count as an improvement.
+        - n_jobs: The number of workers predicting row batches, boosting stages\\
+            are fit sequentially. -1 means all the cores.
+        - backend: 'threads', 'processes' or 'sequential'.
         """
+        if tree_method not in ('exact', 'hist'):
+            raise ValueError(f'Unknown tree_method: {tree_method}')
+        if not 0 < subsample <= 1:
+            raise ValueError(f'subsample must be in range (0, 1], got {subsample}')
         self._n_estimators = n_estimators
         self._lr = learning_rate
         self._max_depth = max_depth
         self._feature_subsample_size = feature_subsample_size
         if self._feature_subsample_size is None:
             self._feature_subsample_size = 0.33
+        self._subsample = subsample
+        self._tree_method = tree_method
+        self._max_bins = max_bins
+        self._n_iter_no_change = n_iter_no_change
+        self._tol = tol
+        self._n_jobs = n_jobs
+        self._backend = validate_backend(backend)
         self._tree_params = trees_parameters
         self._models = None  # stores a tuple of (model, weight)
+        self._compiled = None  # flat-array predictor, built from self._models
+        self._fit_state = None  # running predictions of the last fit
 
     def fit(self,
             X: np.ndarray,
             y: np.ndarray,
             X_val: Optional[np.ndarray] = None,
-            y_val: Optional[np.ndarray] = None) -> None:
+            y_val: Optional[np.ndarray] = None,
+            warm_start: bool = False,
+            binned: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+            callback: Optional[Callable[[dict], Optional[bool]]] = None) -> None:
         """
         Parameters
         -------
@@ -178,68 +626,107 @@ class GradientBoostingMSE:
         - y: Array of size n_objects containing train targets
         - X_val: Array of size n_val_objects, n_features
         - y_val: Array of size n_val_objects
+        - warm_start: Keep already fitted stages and continue boosting from their\\
+            predictions up to n_estimators. Returned losses cover the added stages only.
+        - binned: Tuple (X_binned, bin_edges) of train samples already quantized by\\
+            `HistogramBinner` with max_bins bins, used in 'hist' mode instead of binning X.
+        - callback: Function called after every stage with a dict of 'stage' (the number\\
+            of stages), 'n_estimators', 'elapsed' seconds and the current 'train_loss'\\
+            and 'val_loss'. If it returns True, fitting stops after this stage.
         """
-        self._models = []
-        preds = np.zeros_like(y)
-
-        for _ in range(self._n_estimators):
+        start_time = time.perf_counter()
+        n_prev = self._n_warm_start_trees(warm_start)
+        self._models = self._models[:n_prev] if n_prev else []
+        state = self._resume_state(X, X_val)
+        preds, val_preds = state['train_preds'], state['val_preds']
+        train_loss, val_loss = [], []
+        early_stopping = _EarlyStopping(self._n_iter_no_change, self._tol)
+        if n_prev and X_val is not None:
+            early_stopping.update(np.mean(np.square(val_preds - y_val)), n_prev)
+
+        # quantize features once, all the trees are fit on the same bins
+        X_binned, bin_edges = None, None
+        if self._tree_method == 'hist':
+            if binned is None:
+                binner = HistogramBinner(self._max_bins).fit(X)
+                binned = binner.transform(X), binner.bin_edges
+            X_binned, bin_edges = binned
+
+        for _ in range(self._n_estimators - n_prev):
             # compute antigradient
             residuals = y - preds
 
-            # fit tree to the antigradient
-            estimator = DecisionTreeRegressor(
-                criterion='squared_error',
-                max_depth=self._max_depth,
-                **self._tree_params,
-            )
-            estimator, ftrs_subsample = self._fit_estimator(X, residuals, estimator)
-
-            # find new approximation for predicions
-            approx = estimator.predict(X[:, ftrs_subsample])
-
-            # find next optimization step value
+            # choose subsample of training samples for the stage
+            smpls_subsample = None
+            if self._subsample < 1:
+                smpls_subsample = np.sort(np.random.choice(
+                    np.arange(X.shape[0]),
+                    size=max(1, int(self._subsample * X.shape[0])),
+                    replace=False
+                ))
+
+            # fit tree to the antigradient and find new approximation for predicions on all samples
+            if X_binned is None:
+                estimator = DecisionTreeRegressor(
+                    criterion='squared_error',
+                    max_depth=self._max_depth,
+                    **self._tree_params,
+                )
+                estimator, ftrs_subsample = self._fit_estimator(X, residuals, estimator, smpls_subsample)
+                approx = estimator.predict(X[:, ftrs_subsample])
+            else:
+                estimator = HistogramTreeRegressor(
+                    max_depth=self._max_depth,
+                    **self._tree_params,
+                )
+                estimator, ftrs_subsample, approx = self._fit_hist_estimator(
+                    X_binned, residuals, bin_edges, estimator, smpls_subsample
+                )
+
+            # find next optimization step value on the same samples the tree was fit on
+            step_idx = slice(None) if smpls_subsample is None else smpls_subsample
             alpha = minimize_scalar(
-                fun=lambda x, p=preds, ap=approx, : np.mean(np.square(p + x * ap - y)),
+                fun=lambda x, p=preds[step_idx], ap=approx[step_idx], t=y[step_idx]: np.mean(np.square(p + x * ap - t)),
                 bounds=(0, 1e9),
             ).x
 
             # update predictions vector
             preds = preds + self._lr * alpha * approx
 
-            self._models.append((estimator, self._lr * alpha, ftrs_subsample))
-
-        train_loss = self._calc_loss(X, y)
-
-        val_loss = None
-        if X_val is not None:
-            val_loss = self._calc_loss(X_val, y_val)
+            model = (estimator, self._lr * alpha, ftrs_subsample)
+            self._models.append(model)
+            self._fit_state = {'train_preds': preds, 'val_preds': val_preds}
+
+            # record the loss of the ensemble with the new tree added
+            train_loss.append(np.mean(np.square(preds - y)))
+            stop = False
+            if X_val is not None:
+                val_preds += self._run_estimator(X_val, model)
+                val_loss.append(np.mean(np.square(val_preds - y_val)))
+                stop = early_stopping.update(val_loss[-1], len(self._models))
+            if _report_stage(
+                callback, start_time, len(self._models), self._n_estimators,
+                train_loss[-1], val_loss[-1] if val_loss else None,
+            ) or stop:
+                break
+
+        n_fitted = len(self._models)
+        train_loss, val_loss = self._truncate(early_stopping, n_prev, train_loss, val_loss)
+        self._fit_state = None
+        if len(self._models) == n_fitted:
+            self._fit_state = {'train_preds': preds, 'val_preds': val_preds}
+        self._compiled = self._compile()
 
         return train_loss, val_loss
 
-    def predict(self, X) -> np.ndarray:
-        """
-        Parameters
-        -------
-        - X: Array of size n_objects, n_features - the input samples
-
-        Returns
-        -------
-        - y: Array of size n_objects - predicted values for each input sample
-        """
-        if self._models is None:
-            raise RuntimeError('The model is not fitted. run .fit() first.')
-
-        preds = Parallel(n_jobs=-1)(
-            delayed(self._run_estimator)(X, model) for model in self._models
-        )
-        return np.sum(preds, axis=0)
-
     def _fit_estimator(self,
                        X: np.ndarray,
                        y: np.ndarray,
-                       estimator: DecisionTreeRegressor):
+                       estimator: DecisionTreeRegressor,
+                       smpls_subsample: Optional[np.ndarray] = None):
         """
         Perform fitting of a single estimator with feature selection
+        on the given subsample of training samples
         """
         ftr_subsample_size = int(self._feature_subsample_size * X.shape[1])
         ftrs_subsample = np.random.choice(
@@ -248,14 +735,66 @@ class GradientBoostingMSE:
             replace=False
         )
 
-        X_sub = X[:, ftrs_subsample]
-
-        estimator.fit(X_sub, y)
+        if smpls_subsample is None:
+            estimator.fit(X[:, ftrs_subsample], y)
+        else:
+            estimator.fit(X[np.ix_(smpls_subsample, ftrs_subsample)], y[smpls_subsample])
         return estimator, ftrs_subsample
 
+    def _fit_hist_estimator(self,
+                            X_binned: np.ndarray,
+                            y: np.ndarray,
+                            bin_edges: np.ndarray,
+                            estimator: HistogramTreeRegressor,
+                            smpls_subsample: Optional[np.ndarray] = None):
+        """
+        Perform fitting of a single histogram estimator with feature selection
+        on the given subsample of training samples.
+        Returns predictions of the estimator on all the training samples as well
+        """
+        ftr_subsample_size = int(self._feature_subsample_size * X_binned.shape[1])
+        ftrs_subsample = np.random.choice(
+            np.arange(X_binned.shape[1]),
+            size=ftr_subsample_size,
+            replace=False
+        )
+
+        approx = estimator.fit_predict(X_binned, y, ftrs_subsample, bin_edges, smpls_subsample)
+        return estimator, ftrs_subsample, approx
+
+    def _resume_state(self, X: np.ndarray, X_val: Optional[np.ndarray]) -> dict:
+        """
+        Return predictions of the fitted stages to continue boosting from.
+        The predictions are taken from the last fit if it was on the same data,\
+        otherwise recomputed
+        """
+        state = {
+            'train_preds': np.zeros(X.shape[0]),
+            'val_preds': None if X_val is None else np.zeros(X_val.shape[0]),
+        }
+        if not self._models:
+            return state
+
+        fit_state = self.fit_state or {}
+        state['train_preds'] = fit_state.get('train_preds')
+        if not _matches(state['train_preds'], X):
+            state['train_preds'] = self._predict_compiled(X)
+        if X_val is not None:
+            state['val_preds'] = fit_state.get('val_preds')
+            if not _matches(state['val_preds'], X_val):
+                state['val_preds'] = self._predict_compiled(X_val)
+        return {key: None if value is None else np.array(value, dtype=np.float64) for key, value in state.items()}
+
+    def _compile(self) -> CompiledEnsemble:
+        """Pack fitted trees into a flat-array predictor with alpha weights folded in"""
+        return CompiledEnsemble(
+            (estimator.tree_, ftrs_subsample, alpha)
+            for estimator, alpha, ftrs_subsample in self._models
+        )
+
     def _run_estimator(self,
                        X: np.ndarray,
-                       estimator: Tuple[DecisionTreeRegressor, float]) -> np.ndarray:
+                       estimator: Tuple[DecisionTreeRegressor | HistogramTreeRegressor, float]) -> np.ndarray:
         """
         Run single estimator from ensemble and collect its predictions.
         Parameters:
@@ -265,11 +804,3 @@ class GradientBoostingMSE:
         """
         estimator, alpha, ftrs_subsample = estimator
         return alpha * estimator.predict(X[:, ftrs_subsample])
-
-    def _calc_loss(self, X: np.ndarray, y: np.ndarray):
-        preds = Parallel(n_jobs=-1)(
-            delayed(self._run_estimator)(X, model) for model in self._models
-        )
-        preds = np.cumsum(preds, axis=0)
-        loss = np.mean(np.square(preds - y), axis=1)
-        return loss
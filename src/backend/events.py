@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+import redis
+import redis.asyncio
+
+from settings import settings
+
+
+# channel of status messages published by workers and sent to websocket clients
+EVENTS_CHANNEL = 'events'
+
+# prefix of keys of flags asking running fits to stop, and their lifetime in seconds
+CANCEL_KEY_PREFIX = 'fit_cancel:'
+CANCEL_TTL_S = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+_client: redis.Redis | None = None
+
+
+def _get_client() -> redis.Redis:
+    """Return the redis client of the process"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+
+def publish(message: str) -> None:
+    """Publish a status message to all the API processes"""
+    _get_client().publish(EVENTS_CHANNEL, message)
+
+
+def request_cancel(model_id) -> None:
+    """Ask the running or queued fit of the model to stop"""
+    _get_client().set(f'{CANCEL_KEY_PREFIX}{model_id}', 1, ex=CANCEL_TTL_S)
+
+
+def cancel_requested(model_id) -> bool:
+    """Check whether the fit of the model was asked to stop"""
+    return bool(_get_client().exists(f'{CANCEL_KEY_PREFIX}{model_id}'))
+
+
+def clear_cancel(model_id) -> None:
+    """Forget the request to stop the fit of the model"""
+    _get_client().delete(f'{CANCEL_KEY_PREFIX}{model_id}')
+
+
+async def listen(handler: Callable[[str], Awaitable[None]], retry_delay: float = 1.0) -> None:
+    """
+    Call the handler with every published status message. The subscription\\
+    is restored if the connection to redis is lost, messages published in\\
+    the meantime are missed.
+
+    Parameters:
+    -------
+    - handler: coroutine function called with the message
+    - retry_delay: the time in seconds to wait before reconnecting
+    """
+    while True:
+        try:
+            client = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(EVENTS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    try:
+                        await handler(message['data'].decode())
+                    except Exception:  # a failed delivery does not stop the subscription
+                        logger.exception('Failed to handle message from %s', EVENTS_CHANNEL)
+        except redis.RedisError:
+            logger.exception('Lost subscription to %s, reconnecting', EVENTS_CHANNEL)
+            await asyncio.sleep(retry_delay)
+        finally:
+            await client.aclose()
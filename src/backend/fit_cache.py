@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+
+import numpy as np
+
+
+FIT_CACHE_DIR = 'storage/fit_cache'
+
+_LOSSES = ('train_loss', 'val_loss', 'oob_loss')
+
+
+def fit_key(model_db_item) -> str | None:
+    """
+    Return the key of the fit of the model: a hash of the content hashes of\\
+    its train and validation datasets, the target name, the model type and\\
+    its parameters, including the seed of the trees if it is fixed. Fits on\\
+    legacy .csv datasets, which have no content hash, are not cached.
+
+    Parameters:
+    -------
+    - model_db_item: record of the model from the \'ml_models\' table
+    """
+    paths = [model_db_item.train_dataset_file_path, model_db_item.val_dataset_file_path]
+    if paths[0] is None or not all(path is None or os.path.isdir(path) for path in paths):
+        return None
+
+    model_parameters = json.loads(model_db_item.model_parameters)
+    description = json.dumps({
+        # stored datasets are named by the hash of their content
+        'train_dataset_hash': os.path.basename(paths[0]),
+        'val_dataset_hash': None if paths[1] is None else os.path.basename(paths[1]),
+        'target_name': model_db_item.target_name,
+        'model_type': model_db_item.model_type,
+        'ensemble_params': model_parameters['ensemble_params'],
+        'tree_params': model_parameters['tree_params'],
+    }, sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    """Return directory of the cached fit"""
+    return os.path.join(FIT_CACHE_DIR, key)
+
+
+def get(key: str | None, max_age: float) -> dict | None:
+    """
+    Return the cached fit with the given key: dict with \'model_file\', the path\\
+    of the serialized model, and staged losses. Returns None on a miss or if\\
+    the fit is older than max_age seconds.
+    """
+    if key is None:
+        return None
+    path = _entry_path(key)
+    try:
+        if time.time() - os.path.getmtime(os.path.join(path, 'model.pkl')) > max_age:
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        with np.load(os.path.join(path, 'losses.npz')) as losses:
+            entry = {name: losses[name] if name in losses else None for name in _LOSSES}
+        # the last use of the entry, least recently used entries are evicted first
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    entry['model_file'] = os.path.join(path, 'model.pkl')
+    return entry
+
+
+def put(key: str, model_file: str, **losses) -> None:
+    """
+    Add the fit to the cache. The entry is written to a temporary directory\\
+    and renamed, so readers never see a partial entry.
+
+    Parameters:
+    -------
+    - key: key of the fit, see `fit_key`
+    - model_file: path of the serialized fitted model, it is copied
+    - losses: staged \'train_loss\', \'val_loss\' and \'oob_loss\', None if missing
+    """
+    path = _entry_path(key)
+    if os.path.exists(path):
+        return
+
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp_path)
+    shutil.copyfile(model_file, os.path.join(tmp_path, 'model.pkl'))
+    np.savez(os.path.join(tmp_path, 'losses.npz'), **{
+        name: loss for name, loss in losses.items() if loss is not None
+    })
+    try:
+        os.rename(tmp_path, path)
+    except OSError:  # the same fit was cached by another worker meanwhile
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def evict(max_bytes: int, max_age: float) -> None:
+    """
+    Remove fits older than max_age seconds, then least recently used fits\\
+    until the cache takes at most max_bytes.
+    """
+    if not os.path.isdir(FIT_CACHE_DIR):
+        return
+
+    now = time.time()
+    entries = []
+    for name in os.listdir(FIT_CACHE_DIR):
+        if name.endswith('.tmp'):
+            continue
+        path = _entry_path(name)
+        try:
+            created = os.path.getmtime(os.path.join(path, 'model.pkl'))
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            last_used = os.path.getmtime(path)
+        except FileNotFoundError:
+            continue
+        if now - created > max_age:
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            entries.append((last_used, size, path))
+
+    size_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if size_bytes <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        size_bytes -= size
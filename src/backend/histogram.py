@@ -0,0 +1,307 @@
+from typing import Optional
+
+import numpy as np
+
+
+TREE_LEAF = -1
+TREE_UNDEFINED = -2
+
+
+class HistogramBinner:
+    def __init__(self, max_bins: int = 255, subsample: Optional[int] = 200_000) -> None:
+        """
+        Quantize features into at most `max_bins` uint8 bins. Missing values get\\
+        a bin of their own, the last one, with the code `max_bins`.
+
+        Parameters
+        -------
+        - max_bins: the maximum number of bins per feature, at most 255.
+        - subsample: the number of samples used to compute quantiles.\\
+            If None then use all samples.
+        """
+        if not 2 <= max_bins <= 255:
+            raise ValueError(f'max_bins must be in range [2, 255], got {max_bins}')
+        self._max_bins = max_bins
+        self._subsample = subsample
+        self.bin_edges = None  # array of size n_features, max_bins - 1
+
+    def fit(self, X: np.ndarray) -> 'HistogramBinner':
+        """
+        Compute bin edges for every feature from its present values. The value `x`\\
+        falls into the bin `b` if bin_edges[b - 1] < x <= bin_edges[b], so the split\\
+        `bin <= b` is equivalent to the split `x <= bin_edges[b]`.
+
+        Parameters
+        -------
+        - X: array of size n_objects, n_features containing train samples
+        """
+        rows = np.arange(X.shape[0])
+        if self._subsample is not None and X.shape[0] > self._subsample:
+            rows = np.sort(np.random.choice(rows, size=self._subsample, replace=False))
+
+        self.bin_edges = np.full((X.shape[1], self._max_bins - 1), np.inf)
+        for feature in range(X.shape[1]):
+            # trees compare features in float32, so bins are built in the same precision
+            column = np.asarray(X[rows, feature], dtype=np.float32).astype(np.float64)
+            column = column[~np.isnan(column)]
+            values = np.unique(column)
+            if values.shape[0] == 0:
+                continue
+            if values.shape[0] <= self._max_bins:
+                edges = (values[:-1] + values[1:]) / 2
+            else:
+                quantiles = np.linspace(0, 100, self._max_bins + 1)[1:-1]
+                edges = np.unique(np.percentile(column, quantiles, method='midpoint'))
+            self.bin_edges[feature, :edges.shape[0]] = edges
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        """
+        Parameters
+        -------
+        - X: array of size n_objects, n_features - the input samples
+
+        Returns
+        -------
+        - X_binned: column-major uint8 array of size n_objects, n_features,\\
+            missing values are in the bin `max_bins`
+        """
+        if self.bin_edges is None:
+            raise RuntimeError('The binner is not fitted. run .fit() first.')
+
+        X_binned = np.empty(X.shape, dtype=np.uint8, order='F')
+        for feature in range(X.shape[1]):
+            column = np.asarray(X[:, feature], dtype=np.float32).astype(np.float64)
+            X_binned[:, feature] = np.where(
+                np.isnan(column),
+                self._max_bins,
+                np.searchsorted(self.bin_edges[feature], column, side='left'),
+            )
+        return X_binned
+
+
+class HistogramTree:
+    """Flat array representation of a fitted tree, laid out like `sklearn.tree._tree.Tree`"""
+    def __init__(self,
+                 children_left: np.ndarray,
+                 children_right: np.ndarray,
+                 feature: np.ndarray,
+                 threshold: np.ndarray,
+                 missing_go_to_left: np.ndarray,
+                 value: np.ndarray) -> None:
+        self.children_left = children_left
+        self.children_right = children_right
+        self.feature = feature
+        self.threshold = threshold
+        self.missing_go_to_left = missing_go_to_left
+        self.value = value
+        self.node_count = value.shape[0]
+
+
+class HistogramTreeRegressor:
+    def __init__(self,
+                 max_depth: Optional[int] = None,
+                 min_samples_split: int = 2,
+                 min_samples_leaf: int = 1,
+                 min_impurity_decrease: float = 0.0,
+                 **unused_parameters) -> None:
+        """
+        Regression tree with squared error criterion, which finds splits from\\
+        per-node gradient histograms over pre-binned features.
+
+        Parameters
+        -------
+        - max_depth: the maximum depth of the tree.\\
+            If None then there is no limits.
+        - min_samples_split: the minimum number of samples to split a node.
+        - min_samples_leaf: the minimum number of samples in a leaf.
+        - min_impurity_decrease: split a node only if it decreases the weighted\\
+            impurity by at least this value.
+        - unused_parameters: other `DecisionTreeRegressor` parameters, which are\\
+            accepted for compatibility and ignored.
+        """
+        self._max_depth = max_depth
+        self._min_samples_split = max(min_samples_split, 2 * min_samples_leaf)
+        self._min_samples_leaf = min_samples_leaf
+        self._min_impurity_decrease = min_impurity_decrease
+        self.tree_ = None
+        self._bin_threshold = None
+
+    def fit_predict(self,
+                    X_binned: np.ndarray,
+                    y: np.ndarray,
+                    features: np.ndarray,
+                    bin_edges: np.ndarray,
+                    sample_idx: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Fit the tree on the given features and return its predictions on all the training samples.
+        Missing values of every split go to the child which decreases the loss more.
+
+        Parameters
+        -------
+        - X_binned: uint8 array of size n_objects, n_all_features, missing values\\
+            are in the last bin, see `HistogramBinner`
+        - y: array of size n_objects containing train targets (antigradient)
+        - features: indices of the features available to the tree. Fitted node\\
+            features index this array, as if the tree was fit on X[:, features]
+        - bin_edges: array of size n_all_features, n_bins - 1 from `HistogramBinner`
+        - sample_idx: indices of the samples to fit the tree on.\\
+            If None then use all samples.
+        """
+        # present values fall into n_bins bins, followed by the bin of missing values
+        n_bins = bin_edges.shape[1] + 1
+        self._missing_bin = n_bins
+        root_idx = np.arange(X_binned.shape[0]) if sample_idx is None else sample_idx
+        n_samples = root_idx.shape[0]
+        offsets = np.arange(features.shape[0]) * (n_bins + 1)
+
+        children_left, children_right, feature, bin_threshold, missing_left, value = [], [], [], [], [], []
+        preds = np.empty(X_binned.shape[0], dtype=np.float64)
+
+        def histogram(idx):
+            codes = X_binned[np.ix_(idx, features)].astype(np.intp) + offsets
+            weights = np.broadcast_to(y[idx, None], codes.shape).ravel()
+            sums = np.bincount(codes.ravel(), weights=weights, minlength=offsets.shape[0] * (n_bins + 1))
+            counts = np.bincount(codes.ravel(), minlength=offsets.shape[0] * (n_bins + 1))
+            return sums.reshape(-1, n_bins + 1), counts.reshape(-1, n_bins + 1)
+
+        def add_node(total, count):
+            children_left.append(TREE_LEAF)
+            children_right.append(TREE_LEAF)
+            feature.append(TREE_UNDEFINED)
+            bin_threshold.append(0)
+            missing_left.append(False)
+            value.append(total / count)
+            return len(value) - 1
+
+        root_hist = histogram(root_idx)
+        # stack of (node id, sample indices, histograms, depth)
+        stack = [(add_node(y[root_idx].sum(), n_samples), root_idx, root_hist, 0)]
+        while stack:
+            node, idx, (sums, counts), depth = stack.pop()
+
+            split = None
+            if self._max_depth is None or depth < self._max_depth:
+                split = self._find_split(sums, counts, n_samples)
+            if split is None:
+                preds[idx] = value[node]
+                continue
+            split_feature, split_bin, split_missing_left = split
+
+            codes = X_binned[idx, features[split_feature]]
+            goes_left = np.where(codes == self._missing_bin, split_missing_left, codes <= split_bin)
+            left_idx, right_idx = idx[goes_left], idx[~goes_left]
+
+            # build the histogram for the smaller child only, the sibling one is the difference
+            if left_idx.shape[0] <= right_idx.shape[0]:
+                left_hist = histogram(left_idx)
+                right_hist = sums - left_hist[0], counts - left_hist[1]
+            else:
+                right_hist = histogram(right_idx)
+                left_hist = sums - right_hist[0], counts - right_hist[1]
+
+            feature[node] = split_feature
+            bin_threshold[node] = split_bin
+            missing_left[node] = split_missing_left
+            children_left[node] = add_node(y[left_idx].sum(), left_idx.shape[0])
+            children_right[node] = add_node(y[right_idx].sum(), right_idx.shape[0])
+            stack.append((children_right[node], right_idx, right_hist, depth + 1))
+            stack.append((children_left[node], left_idx, left_hist, depth + 1))
+
+        feature = np.array(feature, dtype=np.intp)
+        self._bin_threshold = np.array(bin_threshold, dtype=np.uint8)
+        # the split of the last bin sends all the present values to the left
+        edges = np.hstack([bin_edges, np.full((bin_edges.shape[0], 1), np.inf)])
+        threshold = np.where(
+            feature >= 0,
+            edges[features[np.maximum(feature, 0)], self._bin_threshold],
+            TREE_UNDEFINED,
+        )
+        self.tree_ = HistogramTree(
+            children_left=np.array(children_left, dtype=np.intp),
+            children_right=np.array(children_right, dtype=np.intp),
+            feature=feature,
+            threshold=threshold,
+            missing_go_to_left=np.array(missing_left, dtype=bool),
+            value=np.array(value, dtype=np.float64),
+        )
+
+        if sample_idx is not None:
+            # samples outside of the subsample are routed through the tree by their bins
+            return self.tree_.value[self._apply(X_binned, self._bin_threshold, features)]
+        return preds
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Parameters
+        -------
+        - X: array of size n_objects, n_features - the input samples,\\
+            with the same features as passed to the fit
+
+        Returns
+        -------
+        - y: array of size n_objects - predicted values for each input sample
+        """
+        if self.tree_ is None:
+            raise RuntimeError('The model is not fitted. run .fit_predict() first.')
+
+        X = np.asarray(X, dtype=np.float32)
+        return self.tree_.value[self._apply(X, self.tree_.threshold)]
+
+    def _apply(self,
+               X: np.ndarray,
+               threshold: np.ndarray,
+               columns: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Return the leaf index for every sample, splitting nodes by `X[:, columns[feature]] <= threshold`.
+        If columns is None, node features index X directly and missing values are NaN,\
+        otherwise X is binned and missing values are in the last bin
+        """
+        tree = self.tree_
+        nodes = np.zeros(X.shape[0], dtype=np.intp)
+        active = np.arange(X.shape[0])
+        while active.shape[0] > 0:
+            current = nodes[active]
+            is_split = tree.children_left[current] != TREE_LEAF
+            active, current = active[is_split], current[is_split]
+            feature = tree.feature[current] if columns is None else columns[tree.feature[current]]
+            values = X[active, feature]
+            is_missing = np.isnan(values) if columns is None else values == self._missing_bin
+            goes_left = np.where(is_missing, tree.missing_go_to_left[current], values <= threshold[current])
+            nodes[active] = np.where(goes_left, tree.children_left[current], tree.children_right[current])
+        return nodes
+
+    def _find_split(self, sums: np.ndarray, counts: np.ndarray, n_samples_total: int):
+        """
+        Find the best (feature, bin, missing values go left) split from node histograms\
+        of size n_features, n_bins + 1, where the last bin holds missing values.
+        Returns None if the node should not be split.
+        """
+        total, count = sums[0].sum(), counts[0].sum()
+        if count < self._min_samples_split:
+            return None
+
+        # present values up to the bin go left, missing values go right or left
+        left_sum = np.cumsum(sums[:, :-1], axis=1)
+        left_count = np.cumsum(counts[:, :-1], axis=1)
+        left_sum = np.stack([left_sum, left_sum + sums[:, -1:]])
+        left_count = np.stack([left_count, left_count + counts[:, -1:]])
+        right_sum = total - left_sum
+        right_count = count - left_count
+
+        valid = (
+            (left_count >= max(self._min_samples_leaf, 1))
+            & (right_count >= max(self._min_samples_leaf, 1))
+        )
+        if not valid.any():
+            return None
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain = np.square(left_sum) / left_count + np.square(right_sum) / right_count
+        gain = np.where(valid, gain - total ** 2 / count, -np.inf)
+
+        missing_left, best_feature, best_bin = np.unravel_index(np.argmax(gain), gain.shape)
+        best_gain = gain[missing_left, best_feature, best_bin]
+        if best_gain <= 0 or best_gain / n_samples_total < self._min_impurity_decrease:
+            return None
+        return int(best_feature), int(best_bin), bool(missing_left)
@@ -1,25 +1,49 @@
+import io
+import os
 import uuid
 import json
 import time
 import asyncio
+import shutil
+import itertools
+from contextlib import asynccontextmanager
+from typing import BinaryIO, Iterator
 
 import numpy as np
+from celery import chord
 
 from fastapi import (
     FastAPI, WebSocket, UploadFile, APIRouter,
-    WebSocketDisconnect, Form, Depends, File
+    WebSocketDisconnect, Form, Depends, File, HTTPException, Query
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
 from database import get_db
-from tasks import fit_model_task
+from tasks import fit_model_task, fit_shard_task, fit_shards_failed_task, merge_shards_task, predict_model_task
 from sockets import connection_manager
+from model_cache import model_cache
+from batching import scoring_batcher
+from settings import settings
 import crud
+import events
+import fit_cache
+import scheduling
 import schemas
 import utils
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Send status messages published by celery workers to websocket clients"""
+    listener = asyncio.create_task(events.listen(connection_manager.broadcast))
+    yield
+    listener.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 router = APIRouter(prefix="/api")
 
 app.add_middleware(
@@ -84,10 +108,13 @@ def put_train_files(uuid_task: uuid.UUID,
                     target_name: str = Form(...),
                     train_file: UploadFile = File(...),
                     val_file: UploadFile | None = File(None),
-                    db: Session = Depends(get_db)) -> None:
+                    db: Session = Depends(get_db)) -> schemas.UploadOut:
     """
-    Process train and validation data files, save files to the storage\\
-    and update record in the corresponding record in \'ml_models\' table.
+    Stream train and validation data files into the dataset storage and\\
+    update record in the corresponding record in \'ml_models\' table.\\
+    Files are stored by the hash of their contents, so a dataset uploaded\\
+    for several models is parsed and stored once. Files are parsed in chunks\\
+    of rows, so memory use does not depend on the file size.
 
     Parameters:
     -------
@@ -96,12 +123,98 @@ def put_train_files(uuid_task: uuid.UUID,
     - train_file: uploaded train file in .csv format
     - val_file: uploaded validation file in .csv format
     - db: database session
+
+    Returns:
+    -------
+    - the number of rows, columns and column statistics of the stored datasets
     """
-    train_data = utils.validate_csv(train_file, target_name)
-    val_data = None
+    # files already in the storage are not parsed again
+    train_hash = utils.hash_upload(train_file, target_name)
+    val_hash = None
     if val_file is not None:
-        val_data = utils.validate_csv(val_file, target_name)
-    crud.update_model(db, uuid_task, target_name=target_name, train_dataset=train_data, val_dataset=val_data)
+        val_hash = utils.hash_upload(val_file, target_name)
+
+    model_db_item = crud.update_model(
+        db,
+        uuid_task,
+        target_name=target_name,
+        train_dataset_hash=train_hash,
+        train_file=train_file.file,
+        val_dataset_hash=val_hash,
+        val_file=val_file.file if val_file is not None else None,
+    )
+
+    val_dataset = None
+    if val_hash is not None:
+        val_dataset = utils.dataset_out(val_hash, model_db_item.val_dataset_file_path)
+    return schemas.UploadOut(
+        train_dataset=utils.dataset_out(train_hash, model_db_item.train_dataset_file_path),
+        val_dataset=val_dataset,
+    )
+
+
+def _submit_fit(model_db_item, warm_start: bool = False) -> None:
+    """
+    Send the fit of the model to the celery queue of its estimated size.\\
+    Large random forests are split into shards fitted in parallel, and the\\
+    shards are merged into one model when all of them are fitted, or removed\\
+    if one of them fails.
+    """
+    size, queue = scheduling.fit_route(model_db_item)
+    # a cancellation requested before this fit does not apply to it
+    events.clear_cancel(model_db_item.id)
+
+    n_shards = 1 if warm_start else scheduling.n_shards(model_db_item, size)
+    if n_shards > 1:
+        # a fixed seed of the model gives the same forest for the same number of shards
+        random_state = json.loads(model_db_item.model_parameters)['tree_params'].get('random_state')
+        entropy = np.random.SeedSequence(random_state).entropy
+        # the merge predicts every tree on the whole data, so it is a large job as well
+        merge = merge_shards_task.s(str(model_db_item.id)).set(queue=queue)
+        chord(
+            fit_shard_task.s(str(model_db_item.id), shard, n_shards, entropy).set(queue=queue)
+            for shard in range(n_shards)
+        )(merge.on_error(fit_shards_failed_task.s(str(model_db_item.id), n_shards)))
+        return
+
+    fit_model_task.apply_async(
+        args=(str(model_db_item.id),),
+        kwargs={'warm_start': warm_start, 'size': size},
+        queue=queue,
+    )
+
+
+def _cached_fit(db: Session, uuid_task: uuid.UUID) -> schemas.ModelStatusElement | None:
+    """
+    Copy the result of the same fit from the fit cache to the model.\\
+    Returns the status of the model, or None if the fit is not cached.
+    """
+    if settings.FIT_CACHE_MB <= 0:
+        return None
+    model_db_item = crud.read_model_item(db, uuid_task)
+    cached = fit_cache.get(fit_cache.fit_key(model_db_item), settings.FIT_CACHE_MAX_AGE_H * 3600)
+    if cached is None:
+        return None
+
+    try:
+        model_db_item = crud.update_model(
+            db,
+            uuid_task,
+            model_file=cached['model_file'],
+            train_loss=cached['train_loss'],
+            val_loss=cached['val_loss'],
+            oob_loss=cached['oob_loss'],
+        )
+    except FileNotFoundError:  # evicted meanwhile
+        return None
+    # running predictions of the previous fit do not match the copied model
+    utils.save_fit_state(model_db_item.id, None, '')
+    return schemas.ModelStatusElement(
+        id=model_db_item.id,
+        model_name=model_db_item.model_name,
+        is_trained=model_db_item.is_trained,
+        target_name=model_db_item.target_name,
+    )
 
 
 @router.websocket('/model/fit')
@@ -110,7 +223,11 @@ async def fit_model(websocket: WebSocket,
     """
     Fit model on the train data and send notification through the\\
     websocket when the fit finishes and the fitted model is updated\\
-    in the \'ml_models\' table.
+    in the \'ml_models\' table. Fits run in celery workers, and the socket\\
+    keeps accepting uuids of other models to fit meanwhile. Throttled\\
+    \'fit_progress\' messages with the current stage and losses are sent\\
+    while the model is fitted. A model with the same type and parameters\\
+    already fitted on the same data is copied from the fit cache instead.
 
     Parameters:
     -------
@@ -123,8 +240,14 @@ async def fit_model(websocket: WebSocket,
         while True:
             uuid_task = await websocket.receive_text()
 
+            # the lookup, the database update and the copy of the model block
+            cached_fit = await run_in_threadpool(_cached_fit, db, uuid_task)
+            if cached_fit is not None:
+                await connection_manager.broadcast(cached_fit.model_dump_json())
+                continue
+
             # send message about fitting start
-            model_db_item = crud.update_model(db, uuid_task, is_trained=False)
+            model_db_item = await run_in_threadpool(crud.update_model, db, uuid_task, is_trained=False)
             model_status = schemas.ModelStatusElement(
                 id=model_db_item.id,
                 model_name=model_db_item.model_name,
@@ -133,42 +256,230 @@ async def fit_model(websocket: WebSocket,
             ).model_dump_json()
             await connection_manager.broadcast(model_status)
 
-            fit_task = fit_model_task.delay(uuid_task)
+            # the worker publishes the status when the fit finishes
+            await run_in_threadpool(_submit_fit, model_db_item)
+    except WebSocketDisconnect:
+        connection_manager.disconnect(websocket)
 
-            while not fit_task.ready():
-                await asyncio.sleep(1)
 
-            model_status = fit_task.result
+@router.websocket('/events')
+async def events_socket(websocket: WebSocket,
+                        model_id: list[str] | None = Query(None)):
+    """
+    Send model status and progress messages about the subscribed models\\
+    through the websocket. Models can be subscribed to with \'model_id\'\\
+    query parameters when connecting, and by sending\\
+    {"subscribe": [ids]} or {"unsubscribe": [ids]} messages.
 
-            await connection_manager.broadcast(model_status)
+    Parameters:
+    -------
+    - websocket: fastapi websocket
+    - model_id: ids of the models to subscribe to.\\
+    If not passed, messages about all models are sent
+    """
+    await connection_manager.connect(websocket, model_id)
+
+    try:
+        while True:
+            try:
+                command = json.loads(await websocket.receive_text())
+                connection_manager.subscribe(websocket, [str(id_) for id_ in command.get('subscribe', [])])
+                connection_manager.unsubscribe(websocket, [str(id_) for id_ in command.get('unsubscribe', [])])
+            except (ValueError, AttributeError, TypeError):
+                await websocket.send_text(json.dumps({'event': 'error', 'detail': 'Bad subscription message'}))
     except WebSocketDisconnect:
         connection_manager.disconnect(websocket)
 
 
-@router.post('/model/predict/{uuid_task}')
-def predict(uuid_task: uuid.UUID,
-            test_file: UploadFile = File(...),
-            db: Session = Depends(get_db)) -> schemas.StorageFileOut:
+@router.post('/model/grow/{uuid_task}')
+async def grow_model(uuid_task: uuid.UUID,
+                     grow_params: schemas.GrowIn,
+                     db: Session = Depends(get_db)) -> schemas.ModelStatusElement:
     """
-    Predict target for passed data.
+    Add trees to the trained model up to the passed number of estimators.\\
+    Already fitted trees are kept, and the notification is sent through the\\
+    \'/model/fit\' websocket when the new trees are fitted.
 
     Parameters:
     -------
     - uuid_task: uuid of the trained model
-    - test_file: uploaded test file in .csv format
+    - grow_params: the new number of estimators
+    - db: database session
+    """
+    model_db_item = await run_in_threadpool(crud.read_model_item, db, uuid_task)
+    if not model_db_item.is_trained:
+        raise HTTPException(409, detail='Model is not trained')
+    n_estimators = json.loads(model_db_item.model_parameters)['ensemble_params']['n_estimators']
+    if grow_params.n_estimators <= n_estimators:
+        raise HTTPException(422, detail=f'n_estimators must be greater than {n_estimators}')
+
+    model_db_item = await run_in_threadpool(
+        crud.update_model, db, uuid_task, n_estimators=grow_params.n_estimators, is_trained=False
+    )
+    model_status = schemas.ModelStatusElement(
+        id=model_db_item.id,
+        model_name=model_db_item.model_name,
+        is_trained=model_db_item.is_trained,
+        target_name=model_db_item.target_name,
+    )
+    await connection_manager.broadcast(model_status.model_dump_json())
+
+    await run_in_threadpool(_submit_fit, model_db_item, warm_start=True)
+
+    return model_status
+
+
+@router.post('/model/cancel/{uuid_task}')
+def cancel_fit(uuid_task: uuid.UUID,
+               db: Session = Depends(get_db)) -> schemas.ModelStatusElement:
+    """
+    Stop the fit of the model after the current stage. The trees fitted so far\\
+    are kept, truncated to the best stage if early stopping is used, and the\\
+    notification is sent through the \'/model/fit\' websocket when the\\
+    partial model is saved.
+
+    Parameters:
+    -------
+    - uuid_task: uuid of the model being fitted
     - db: database session
     """
-    # get the model from the database
+    model_db_item = crud.read_model_item(db, uuid_task)
+    if model_db_item.is_trained:
+        raise HTTPException(409, detail='Model is not being fitted')
+    events.request_cancel(model_db_item.id)
+
+    return schemas.ModelStatusElement(
+        id=model_db_item.id,
+        model_name=model_db_item.model_name,
+        is_trained=model_db_item.is_trained,
+        target_name=model_db_item.target_name,
+    )
+
+
+def _trained_model(db: Session, uuid_task: uuid.UUID):
+    """Return the record of the trained model and the model from the cache"""
+    # the model is loaded from the artifact store on a cache miss
     model_db_item = crud.read_model_item(db, uuid=uuid_task)
-    model = utils.deserialize(model_db_item)['model_deserialized']
+    model = model_cache.get_model(model_db_item)
+    if model is None:
+        raise HTTPException(409, detail='Model is not trained')
+    return model_db_item, model
 
-    X_test = utils.validate_csv(test_file)
-    y_preds = model.predict(X_test.to_numpy())
 
+def _read_test_chunks(model_db_item, test_file: BinaryIO) -> Iterator[np.ndarray]:
+    """Read the test file in chunks of rows, checking the number of features"""
+    n_features = utils.n_features(model_db_item.train_dataset_file_path, model_db_item.target_name)
+    return utils.read_csv_chunks(test_file, settings.PREDICT_CHUNK_ROWS, n_features)
+
+
+@router.post('/model/predict/{uuid_task}')
+async def predict(uuid_task: uuid.UUID,
+                  test_file: UploadFile = File(...),
+                  db: Session = Depends(get_db)) -> schemas.StorageFileOut:
+    """
+    Predict target for passed data. The file is predicted in chunks of rows\\
+    and predictions are appended to the output file, so memory use does not\\
+    depend on the file size.
+
+    Files larger than PREDICT_INLINE_MAX_MB are predicted by a celery worker:\\
+    the response has the id of the task and the path the predictions will be\\
+    written to, and progress is sent through the \'/model/fit\' websocket.
+
+    Parameters:
+    -------
+    - uuid_task: uuid of the trained model
+    - test_file: uploaded test file in .csv format
+    - db: database session
+    """
     preds_file_path = f'storage/predictions/{time.perf_counter_ns()}.csv'
-    np.savetxt(preds_file_path, y_preds, delimiter=',')
 
-    return schemas.StorageFileOut(file_path=preds_file_path)
+    if test_file.size is None or test_file.size <= settings.PREDICT_INLINE_MAX_MB * 2 ** 20:
+        model_db_item, model = await run_in_threadpool(_trained_model, db, uuid_task)
+        chunks = _read_test_chunks(model_db_item, test_file.file)
+        await run_in_threadpool(utils.predict_to_file, model, chunks, preds_file_path)
+        return schemas.StorageFileOut(file_path=preds_file_path)
+
+    model_db_item = await run_in_threadpool(crud.read_model_item, db, uuid_task)
+    if model_db_item.model_version is None and not model_db_item.is_trained:
+        raise HTTPException(409, detail='Model is not trained')
+
+    # the upload is copied to the shared storage for the worker
+    test_file_path = f'storage/uploads/{time.perf_counter_ns()}.csv'
+    await run_in_threadpool(_save_upload, test_file.file, test_file_path)
+    predict_task = predict_model_task.delay(str(uuid_task), test_file_path, preds_file_path)
+
+    return schemas.StorageFileOut(file_path=preds_file_path, task_id=predict_task.id)
+
+
+def _save_upload(file: BinaryIO, path: str) -> None:
+    """Copy the uploaded file to the storage"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as stored_file:
+        shutil.copyfileobj(file, stored_file)
+
+
+@router.post('/model/predict/{uuid_task}/stream')
+def predict_stream(uuid_task: uuid.UUID,
+                   test_file: UploadFile = File(...),
+                   db: Session = Depends(get_db)) -> StreamingResponse:
+    """
+    Predict target for passed data and stream predictions back as a chunked\\
+    .csv response, one value per row. The file is predicted in chunks of rows,\\
+    and the response starts after the first chunk is predicted. A bad chunk\\
+    later in the file ends the response early.
+
+    Parameters:
+    -------
+    - uuid_task: uuid of the trained model
+    - test_file: uploaded test file in .csv format
+    - db: database session
+    """
+    model_db_item, model = _trained_model(db, uuid_task)
+
+    # the first chunk is predicted before the response, so a bad file gets an error status
+    preds = map(model.predict, _read_test_chunks(model_db_item, test_file.file))
+    first_preds = next(preds, None)
+
+    def content() -> Iterator[str]:
+        if first_preds is None:
+            return
+        for y_preds in itertools.chain([first_preds], preds):
+            buffer = io.StringIO()
+            np.savetxt(buffer, y_preds, delimiter=',')
+            yield buffer.getvalue()
+
+    return StreamingResponse(content(), media_type='text/csv')
+
+
+@router.post('/model/score/{uuid_task}')
+async def score(uuid_task: uuid.UUID,
+                score_params: schemas.ScoreIn,
+                db: Session = Depends(get_db)) -> schemas.ScoreOut:
+    """
+    Predict target for the passed feature rows and return predictions inline.\\
+    Concurrent requests to the same model are predicted in one batch.
+
+    Parameters:
+    -------
+    - uuid_task: uuid of the trained model
+    - score_params: feature rows in the order of the train dataset columns
+    - db: database session
+    """
+    model_db_item = await run_in_threadpool(crud.read_model_item, db, uuid_task)
+    model = await run_in_threadpool(model_cache.get_model, model_db_item)
+    if model is None:
+        raise HTTPException(409, detail='Model is not trained')
+
+    n_features = await run_in_threadpool(
+        utils.n_features, model_db_item.train_dataset_file_path, model_db_item.target_name
+    )
+    if not score_params.rows or any(len(row) != n_features for row in score_params.rows):
+        raise HTTPException(422, detail=f'Rows must be non-empty and have {n_features} features')
+
+    X = np.array(score_params.rows, dtype=np.float64)
+    y_preds = await scoring_batcher.predict((model_db_item.id, model_db_item.model_version), model, X)
+
+    return schemas.ScoreOut(predictions=y_preds.tolist())
 
 
 @router.get('/model/{uuid_task}')
@@ -185,7 +496,8 @@ def get_model_info(uuid_task: uuid.UUID,
     """
     model_db_item = crud.read_model_item(db, uuid_task)
 
-    model_out_params = utils.deserialize(model_db_item)
+    # metadata only, the model itself is not loaded
+    model_out_params = utils.deserialize(model_db_item, load_model=False)
     del model_out_params['model_deserialized']
 
     if model_db_item.model_type is schemas.ModelType.random_forest:
@@ -194,6 +506,12 @@ def get_model_info(uuid_task: uuid.UUID,
         return schemas.GBModelOut(**model_out_params)
 
 
+@router.get('/cache/stats')
+def get_cache_stats() -> schemas.CacheStats:
+    """Return hit, miss and eviction counters of the API process model cache"""
+    return schemas.CacheStats(**model_cache.stats())
+
+
 @router.get('/models/list')
 def get_model_names(db: Session = Depends(get_db)) -> schemas.ModelStatuses:
     """Return list with all models' names"""
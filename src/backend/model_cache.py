@@ -0,0 +1,87 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import artifacts
+import models
+from settings import settings
+
+
+class ModelCache:
+    def __init__(self, max_bytes: int):
+        """
+        LRU cache of deserialized models of the API process, keyed by the model\\
+        id and version, so a refitted model is never served from the cache.\\
+        The size of a model is estimated by the size of its serialized artifact.
+
+        Parameters:
+        -------
+        - max_bytes: total size of cached models, least recently used models\\
+        are evicted above it
+        """
+        self._max_bytes = max_bytes
+        self._models: OrderedDict[tuple, tuple[object, int]] = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_model(self, model_db_item: models.MLModel):
+        """
+        Return the deserialized model of a record from the \'ml_models\' table,\\
+        loading it on a cache miss. Returns None if the model is not fitted.
+        """
+        key = (model_db_item.id, model_db_item.model_version)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+            self.misses += 1
+
+        # loading is done without the lock, so misses of other models are not serialized
+        if model_db_item.model_version is not None:
+            model = artifacts.load_model(model_db_item.id, model_db_item.model_version)
+            size = os.path.getsize(artifacts.artifact_path(model_db_item.id, model_db_item.model_version))
+        elif model_db_item.model_serialized is not None:
+            model = pickle.loads(model_db_item.model_serialized)
+            size = len(model_db_item.model_serialized)
+        else:
+            return None
+
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = model, size
+                self._size_bytes += size
+                self._evict()
+        return model
+
+    def invalidate(self, model_id) -> None:
+        """Remove all the cached versions of the model"""
+        with self._lock:
+            for key in [key for key in self._models if key[0] == model_id]:
+                self._size_bytes -= self._models.pop(key)[1]
+
+    def stats(self) -> dict:
+        """Return cache counters and occupancy"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'n_models': len(self._models),
+                'size_bytes': self._size_bytes,
+                'max_bytes': self._max_bytes,
+            }
+
+    def _evict(self) -> None:
+        """Evict least recently used models above the size limit, the newest one is always kept"""
+        while self._size_bytes > self._max_bytes and len(self._models) > 1:
+            _, (_, size) = self._models.popitem(last=False)
+            self._size_bytes -= size
+            self.evictions += 1
+
+
+model_cache = ModelCache(settings.MODEL_CACHE_MB * 2 ** 20)
@@ -1,6 +1,7 @@
 import uuid
 
-from sqlalchemy import Column, Boolean, String, LargeBinary
+from sqlalchemy import Column, Boolean, Integer, String, LargeBinary
+from sqlalchemy.orm import deferred
 from sqlalchemy.dialects.postgresql import UUID, JSON
 
 from database import Base
@@ -20,9 +21,20 @@ class MLModel(Base):
     model_type = Column(String, nullable=False)
     model_parameters = Column(JSON, nullable=False)
     is_trained = Column(Boolean, nullable=False, default=False)
-    model_serialized = Column(LargeBinary, nullable=True)
+    # models are kept in the artifact store, the column holds models fitted before it
+    model_serialized = deferred(Column(LargeBinary, nullable=True))
+    model_version = Column(Integer, nullable=True)
     target_name = Column(String, nullable=True)
     train_dataset_file_path = Column(String, nullable=True)
     val_dataset_file_path = Column(String, nullable=True)
     train_loss = Column(LargeBinary, nullable=True)
     val_loss = Column(LargeBinary, nullable=True)
+    oob_loss = Column(LargeBinary, nullable=True)
+
+
+class Dataset(Base):
+    __tablename__ = 'datasets'
+
+    hash = Column(String, primary_key=True, nullable=False)
+    path = Column(String, unique=True, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
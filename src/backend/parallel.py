@@ -0,0 +1,77 @@
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+from joblib import Parallel
+
+
+# execution backends available for ensembles and the matching joblib backends
+BACKENDS = {
+    'threads': 'threading',
+    'processes': 'loky',
+    'sequential': 'sequential',
+}
+
+_pools: dict[tuple[str, int], Parallel] = {}
+_pools_lock = threading.Lock()
+
+
+def validate_backend(backend: str) -> str:
+    """Check that the execution backend is supported and return it"""
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend: {backend}, expected one of {list(BACKENDS)}')
+    return backend
+
+
+@contextmanager
+def parallel_pool(backend: str = 'threads', n_jobs: int = -1) -> Iterator[Parallel]:
+    """
+    Borrow a long-lived joblib `Parallel` with its workers already started.\\
+    Pools are kept between calls, so repeated fits and predictions do not spawn\\
+    new workers. A pool is used by one caller at a time, concurrent callers of\\
+    the same pool get a temporary one.
+
+    The pool yields results lazily in the order of submitted tasks, and large\\
+    arrays are shared with worker processes as read-only memmaps.
+
+    Parameters:
+    -------
+    - backend: 'threads', 'processes' or 'sequential'
+    - n_jobs: the number of workers, -1 means all the cores
+    """
+    validate_backend(backend)
+    if backend == 'sequential':
+        n_jobs = 1
+    key = (backend, n_jobs)
+
+    with _pools_lock:
+        parallel = _pools.pop(key, None)
+    if parallel is None:
+        parallel = Parallel(
+            n_jobs=n_jobs,
+            backend=BACKENDS[backend],
+            return_as='generator',
+            max_nbytes='1M',
+            mmap_mode='r',
+        )
+        parallel.__enter__()
+
+    try:
+        yield parallel
+    finally:
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key], parallel = parallel, None
+        if parallel is not None:
+            parallel.__exit__(None, None, None)
+
+
+@atexit.register
+def shutdown_pools() -> None:
+    """Stop workers of all the kept pools"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for parallel in pools:
+        parallel.__exit__(None, None, None)
@@ -0,0 +1,95 @@
+import os
+import json
+
+from settings import settings
+import datasets
+import schemas
+
+
+# queues of fit tasks by size, every queue is consumed by its own celery worker
+QUEUES = {
+    'small': 'fit_small',
+    'large': 'fit_large',
+}
+
+# rough size of a value in a .csv file, used to estimate the size of legacy datasets
+_CSV_BYTES_PER_VALUE = 10
+
+
+def estimate_cost(dataset_path: str, n_estimators: int) -> float:
+    """
+    Estimate the cost of fitting the ensemble as rows x features x trees.\\
+    Stored datasets have their shape in the schema, the number of values\\
+    of a .csv dataset is estimated from the file size.
+
+    Parameters:
+    -------
+    - dataset_path: path of the train dataset
+    - n_estimators: the number of trees to fit
+    """
+    if os.path.isdir(dataset_path):
+        schema = datasets.load_schema(dataset_path)
+        n_values = schema['n_rows'] * len(schema['columns'])
+    else:
+        n_values = os.path.getsize(dataset_path) / _CSV_BYTES_PER_VALUE
+    return float(n_values) * n_estimators
+
+
+def job_size(cost: float) -> str:
+    """Return the size class of a job with the estimated cost: 'small' or 'large'"""
+    return 'large' if cost >= settings.FIT_LARGE_MIN_COST else 'small'
+
+
+def cpu_budget() -> int:
+    """The number of cores of the node available to fit tasks"""
+    return settings.FIT_CPU_BUDGET or os.cpu_count() or 1
+
+
+def n_jobs(size: str) -> int:
+    """
+    Return the number of ensemble workers of a job of the given size, so all\\
+    the jobs running on a node at once fit into its CPU budget. Small jobs\\
+    run on one core each, large jobs share the rest of the cores.
+    """
+    if size == 'small':
+        return 1
+    spare_cores = cpu_budget() - settings.FIT_SMALL_CONCURRENCY
+    return max(1, spare_cores // settings.FIT_LARGE_CONCURRENCY)
+
+
+def fit_route(model_db_item) -> tuple[str, str]:
+    """
+    Return the size class of the model\'s fit and the queue to send it to.
+
+    Parameters:
+    -------
+    - model_db_item: record of the model from the \'ml_models\' table
+    """
+    n_estimators = json.loads(model_db_item.model_parameters)['ensemble_params']['n_estimators']
+    size = job_size(estimate_cost(model_db_item.train_dataset_file_path, n_estimators))
+    return size, QUEUES[size]
+
+
+def n_shards(model_db_item, size: str) -> int:
+    """
+    Return the number of shards to split the fit of the model into, 1 means\
+    a single task. Large random forests without early stopping are fitted\
+    by parallel tasks on the large workers, each of at least\
+    FIT_RF_MIN_SHARD_TREES trees.
+
+    Parameters:
+    -------
+    - model_db_item: record of the model from the \'ml_models\' table
+    - size: size class of the fit
+    """
+    if size != 'large' or model_db_item.model_type != schemas.ModelType.random_forest:
+        return 1
+    ensemble_params = json.loads(model_db_item.model_parameters)['ensemble_params']
+    if ensemble_params.get('n_iter_no_change') is not None:
+        return 1
+    return max(1, min(settings.FIT_RF_SHARDS, ensemble_params['n_estimators'] // settings.FIT_RF_MIN_SHARD_TREES))
+
+
+def shard_size(n_estimators: int, shard: int, n_shards: int) -> int:
+    """Return the number of trees of the shard, the trees are split as evenly as possible"""
+    return n_estimators // n_shards + (shard < n_estimators % n_shards)
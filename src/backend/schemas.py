@@ -1,7 +1,7 @@
 import uuid
 from enum import Enum
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class ModelType(str, Enum):
@@ -14,6 +14,11 @@ class Splitter(str, Enum):
     random = 'random'
 
 
+class TreeMethod(str, Enum):
+    exact = 'exact'
+    hist = 'hist'
+
+
 class TreeParams(BaseModel):
     splitter: Splitter = Splitter.best
     min_samples_split: int = 2
@@ -30,6 +35,8 @@ class RFParams(BaseModel):
     n_estimators: int
     max_depth: int | None = None
     feature_subsample_size: float | None = 0.33
+    n_iter_no_change: int | None = None
+    tol: float = 1e-4
 
 
 class GBParams(BaseModel):
@@ -37,6 +44,11 @@ class GBParams(BaseModel):
     learning_rate: float = 0.1
     max_depth: int | None = 5
     feature_subsample_size: float | None = 0.33
+    subsample: float = Field(1.0, gt=0, le=1)
+    tree_method: TreeMethod = TreeMethod.exact
+    max_bins: int = Field(255, ge=2, le=255)
+    n_iter_no_change: int | None = None
+    tol: float = 1e-4
 
 
 class MLModelBase(BaseModel):
@@ -50,6 +62,7 @@ class MLModelOut(MLModelBase):
     val_dataset_file_path: str | None = None
     train_loss: list | None = None
     val_loss: list | None = None
+    oob_loss: list | None = None
 
 
 class RFModelIn(MLModelBase):
@@ -70,8 +83,78 @@ class GBModelOut(GBModelIn, MLModelOut):
     model_type: ModelType = ModelType.gradient_boosting
 
 
+class GrowIn(BaseModel):
+    n_estimators: int
+
+
+class ColumnStats(BaseModel):
+    mean: float | None
+    std: float | None
+    min: float | None
+    max: float | None
+    n_missing: int
+
+
+class DatasetOut(BaseModel):
+    hash: str
+    n_rows: int
+    columns: list[str]
+    target_name: str
+    column_stats: dict[str, ColumnStats]
+
+
+class UploadOut(BaseModel):
+    train_dataset: DatasetOut
+    val_dataset: DatasetOut | None = None
+
+
+class ScoreIn(BaseModel):
+    rows: list[list[float]]
+
+
+class ScoreOut(BaseModel):
+    predictions: list[float]
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    n_models: int
+    size_bytes: int
+    max_bytes: int
+
+
 class StorageFileOut(BaseModel):
     file_path: str
+    task_id: str | None = None
+
+
+class FitProgress(BaseModel):
+    event: str = 'fit_progress'
+    model_id: uuid.UUID
+    stage: int
+    n_estimators: int
+    elapsed: float
+    train_loss: float
+    val_loss: float | None = None
+    oob_loss: float | None = None
+
+
+class FitStatus(BaseModel):
+    event: str = 'fit'
+    task_id: str
+    model_id: uuid.UUID
+    status: str
+
+
+class PredictionStatus(BaseModel):
+    event: str = 'prediction'
+    task_id: str
+    model_id: uuid.UUID
+    status: str
+    n_rows: int = 0
+    file_path: str
 
 
 class ModelStatusElement(BaseModel):
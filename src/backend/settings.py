@@ -7,6 +7,54 @@ class EnvSettings(BaseSettings):
     POSTGRES_DB: str
     POSTGRESQL_HOST: str
 
+    # celery broker and status notifications
+    REDIS_URL: str = 'redis://redis:6379'
+    # messages queued for a websocket client, slower clients are disconnected
+    WEBSOCKET_QUEUE_SIZE: int = 100
+
+    # parallelism of ensembles inside a single celery task
+    ENSEMBLE_BACKEND: str = 'threads'
+    # minimal time in seconds between published progress events of a fit
+    FIT_PROGRESS_INTERVAL_S: float = 0.5
+    # partially fitted models are saved this often, interrupted fits resume from them
+    FIT_CHECKPOINT_INTERVAL_S: float = 300
+    # fits of killed workers are redelivered after this time in seconds
+    FIT_VISIBILITY_TIMEOUT_S: int = 43200
+    # a fit whose worker is lost this many times, e.g. out of memory, fails
+    FIT_MAX_DELIVERIES: int = 3
+
+    # fits are routed to the small or large queue by rows x features x trees,
+    # and share the cores of the node, 0 means all the cores
+    FIT_LARGE_MIN_COST: float = 1e9
+    FIT_CPU_BUDGET: int = 0
+    FIT_SMALL_CONCURRENCY: int = 2
+    FIT_LARGE_CONCURRENCY: int = 1
+    # large random forests are split into this many tasks fitted in parallel
+    FIT_RF_SHARDS: int = 1
+    FIT_RF_MIN_SHARD_TREES: int = 50
+
+    # results of repeated fits of the same model on the same data are reused
+    FIT_CACHE_MB: int = 4096
+    FIT_CACHE_MAX_AGE_H: float = 168
+
+    # datasets of this size are trained on from a memory map instead of RAM
+    OUT_OF_CORE_MIN_MB: int = 1024
+
+    # rows of an uploaded .csv file held in memory at once during ingestion
+    INGEST_CHUNK_ROWS: int = 100_000
+
+    # memory limit of deserialized models cached by the API process
+    MODEL_CACHE_MB: int = 1024
+
+    # concurrent scoring requests to a model are predicted together
+    SCORING_BATCH_WINDOW_MS: float = 2
+    SCORING_MAX_BATCH_ROWS: int = 1024
+
+    # rows of a test file predicted at once by batch scoring
+    PREDICT_CHUNK_ROWS: int = 100_000
+    # larger test files are predicted by celery workers instead of the API process
+    PREDICT_INLINE_MAX_MB: int = 16
+
     @property
     def SQLALCHEMY_DATABASE_URI(self):  # noqa
         """Produce a db URI from settings"""
@@ -1,23 +1,151 @@
-from fastapi import WebSocket
+import json
+import asyncio
+import logging
+
+from fastapi import WebSocket, status
+
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Connection:
+    def __init__(self, websocket: WebSocket, model_ids: set[str] | None, max_queue: int):
+        """
+        Websocket with its outbound queue. Messages with the same coalescing key\\
+        replace each other while they wait in the queue.
+
+        Parameters:
+        -------
+        - websocket: accepted fastapi websocket
+        - model_ids: ids of the models to send messages about. If None, all\\
+        messages are sent
+        - max_queue: the maximum number of queued messages
+        """
+        self.websocket = websocket
+        self.model_ids = model_ids
+        self._queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self._pending: dict = {}  # queued messages by their keys
+        self.writer: asyncio.Task | None = None
+
+    def wants(self, model_id: str | None) -> bool:
+        """Check that the client is subscribed to messages about the model"""
+        return self.model_ids is None or model_id in self.model_ids
+
+    def put(self, message: str, coalesce_key=None) -> bool:
+        """Queue the message, return False if the queue is full"""
+        if coalesce_key is not None and coalesce_key in self._pending:
+            self._pending[coalesce_key] = message
+            return True
+
+        key = object() if coalesce_key is None else coalesce_key
+        try:
+            self._queue.put_nowait(key)
+        except asyncio.QueueFull:
+            return False
+        self._pending[key] = message
+        return True
+
+    async def write(self) -> None:
+        """Send queued messages one after another"""
+        while True:
+            key = await self._queue.get()
+            await self.websocket.send_text(self._pending.pop(key))
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+    def __init__(self, max_queue: int = 100):
+        """
+        Fan out messages to websocket clients. Every connection has a bounded\\
+        queue and its own writer task, so a slow client does not delay others.\\
+        Progress messages waiting in a queue are replaced by newer ones about\\
+        the same model or task, and clients whose queue is still full are\\
+        disconnected.
+
+        Parameters:
+        -------
+        - max_queue: the maximum number of messages queued for a connection
+        """
+        self._max_queue = max_queue
+        self._connections: dict[WebSocket, _Connection] = {}
+        # references to closing websockets of dropped clients, so the tasks are not garbage collected
+        self._closing: set[asyncio.Task] = set()
+
+    @property
+    def active_connections(self) -> list[WebSocket]:
+        """Connected websockets"""
+        return list(self._connections)
+
+    async def connect(self, websocket: WebSocket, model_ids: list[str] | None = None):
+        """
+        Connect to a new websocket.
 
-    async def connect(self, websocket: WebSocket):
-        """Connect to a new websocket"""
+        Parameters:
+        -------
+        - websocket: fastapi websocket
+        - model_ids: ids of the models to send messages about. If None, all\\
+        messages are sent
+        """
         await websocket.accept()
-        self.active_connections.append(websocket)
+        connection = _Connection(websocket, None if model_ids is None else set(model_ids), self._max_queue)
+        connection.writer = asyncio.create_task(self._write(connection))
+        self._connections[websocket] = connection
 
     def disconnect(self, websocket: WebSocket):
         """Delete disconnected websocket from list of available websockets"""
-        self.active_connections.remove(websocket)
+        connection = self._connections.pop(websocket, None)
+        if connection is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    def subscribe(self, websocket: WebSocket, model_ids: list[str]):
+        """Send messages about the models to the websocket, in addition to already subscribed ones"""
+        if model_ids:
+            connection = self._connections[websocket]
+            connection.model_ids = (connection.model_ids or set()) | set(model_ids)
+
+    def unsubscribe(self, websocket: WebSocket, model_ids: list[str]):
+        """Stop sending messages about the models to the websocket"""
+        connection = self._connections[websocket]
+        if connection.model_ids is not None:
+            connection.model_ids -= set(model_ids)
 
     async def broadcast(self, message: str):
-        """Broadcast message on all available websockets"""
-        for connection in self.active_connections:
-            await connection.send_text(message)
+        """Queue message for all available websockets subscribed to its model"""
+        model_id, coalesce_key = self._route(message)
+        for connection in list(self._connections.values()):
+            if connection.wants(model_id) and not connection.put(message, coalesce_key):
+                logger.warning('Dropping slow websocket client %s', connection.websocket.client)
+                self.disconnect(connection.websocket)
+                closing = asyncio.create_task(connection.websocket.close(status.WS_1013_TRY_AGAIN_LATER))
+                self._closing.add(closing)
+                closing.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    def _route(message: str) -> tuple:
+        """
+        Return the model id of the message and its coalescing key. Progress\\
+        events are coalesced by the event type and the task or model id,\\
+        model status messages are never coalesced.
+        """
+        try:
+            data = json.loads(message)
+        except ValueError:
+            return None, None
+        model_id = data.get('model_id', data.get('id'))
+        model_id = None if model_id is None else str(model_id)
+        if 'event' not in data:
+            return model_id, None
+        return model_id, (data['event'], data.get('task_id', model_id))
+
+    async def _write(self, connection: _Connection):
+        """Run the writer of the connection until the client disconnects"""
+        try:
+            await connection.write()
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # the client is gone, it is removed from the connections
+            self.disconnect(connection.websocket)
 
 
-connection_manager = ConnectionManager()
+connection_manager = ConnectionManager(settings.WEBSOCKET_QUEUE_SIZE)
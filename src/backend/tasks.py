@@ -1,66 +1,474 @@
+import os
+import time
 import uuid
+import logging
 
+import numpy as np
 import pandas as pd
 
 from worker import celery
 from ensembles import RandomForestMSE, GradientBoostingMSE
 from database import get_db
+from settings import settings
+import artifacts
+import datasets
+import events
+import fit_cache
+import scheduling
 import utils
 import crud
 import schemas
 
 
-@celery.task
-def fit_model_task(uuid_task: uuid.UUID):
+logger = logging.getLogger(__name__)
+
+
+def _load_dataset(file_path: str, target_name: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Load features and target of the dataset. Stored datasets are memory-mapped as is.\\
+    Large legacy .csv datasets are converted once into a column-major float32 memory map,\\
+    which is used without loading it into RAM.
+    """
+    if os.path.isdir(file_path):
+        return datasets.load_dataset(file_path)
+    if os.path.getsize(file_path) >= settings.OUT_OF_CORE_MIN_MB * 2 ** 20:
+        return datasets.load_memmap(file_path, target_name)
+
+    data = pd.read_csv(file_path)
+    return data.drop(target_name, axis=1).to_numpy(), data[target_name].to_numpy()
+
+
+def _load_fit_data(model_item_deserialized: dict) -> tuple:
+    """Load train features and target, and validation ones if present, of the model"""
+    target_name = model_item_deserialized['target_name']
+    X_train, y_train = _load_dataset(model_item_deserialized['train_dataset_file_path'], target_name)
+
+    X_val, y_val = None, None
+    if model_item_deserialized['val_dataset_file_path'] is not None:
+        X_val, y_val = _load_dataset(model_item_deserialized['val_dataset_file_path'], target_name)
+    return X_train, y_train, X_val, y_val
+
+
+def _dataset_key(model_item_deserialized: dict) -> str:
+    """Return the key of the train and validation data of the model"""
+    return ':'.join([
+        str(model_item_deserialized['train_dataset_file_path']),
+        str(model_item_deserialized['val_dataset_file_path']),
+    ])
+
+
+def _save_fit(db, uuid_task: uuid.UUID, model, dataset_key: str, cache_key: str | None, **losses) -> str:
+    """
+    Save the fitted model with its staged losses and fit state, and publish\\
+    the status of the model. If cache_key is not None, the fit is also added\\
+    to the fit cache. Returns the published status
+    """
+    utils.save_fit_state(uuid_task, model.fit_state, dataset_key)
+    model_db_item = crud.update_model(db, uuid_task, model=model, **losses)
+
+    if cache_key is not None and settings.FIT_CACHE_MB > 0:
+        try:
+            fit_cache.put(cache_key, artifacts.artifact_path(model_db_item.id, model_db_item.model_version), **losses)
+            fit_cache.evict(settings.FIT_CACHE_MB * 2 ** 20, settings.FIT_CACHE_MAX_AGE_H * 3600)
+        except OSError:  # the model is saved anyway
+            logger.exception('Failed to cache the fit of model %s', uuid_task)
+
+    model_status = schemas.ModelStatusElement(
+        id=model_db_item.id,
+        model_name=model_db_item.model_name,
+        is_trained=model_db_item.is_trained,
+        target_name=model_db_item.target_name,
+    ).model_dump_json()
+    events.publish(model_status)
+    return model_status
+
+
+def _extend_loss(loss: np.ndarray | None, new_loss: np.ndarray | None) -> np.ndarray | None:
+    """Append losses of the stages added with warm start to the stored loss curve"""
+    if loss is None or new_loss is None:
+        return new_loss if new_loss is not None else loss
+    return np.concatenate([loss, new_loss])
+
+
+class _FitMonitor:
+    def __init__(self,
+                 model,
+                 model_id: uuid.UUID,
+                 task_id: str,
+                 dataset_key: str,
+                 deliveries: int,
+                 losses: dict,
+                 progress_interval: float,
+                 checkpoint_interval: float) -> None:
+        """
+        Fit callback publishing the progress of the fit at most once per\\
+        progress_interval seconds and always for the last stage. When the\\
+        progress is published, the fit is stopped if it was cancelled. The\\
+        partially fitted model is checkpointed at most once per\\
+        checkpoint_interval seconds.
+
+        Parameters:
+        -------
+        - model: the fitted ensemble
+        - model_id: uuid of the model
+        - task_id: id of the celery task fitting the model
+        - dataset_key: key of the train and validation data of the fit
+        - deliveries: the number of times the task was delivered to a worker
+        - losses: dict of staged \'train_loss\', \'val_loss\' and \'oob_loss\'\\
+        of the stages fitted before, the losses of new stages are appended
+        - progress_interval: the minimal time in seconds between published progress
+        - checkpoint_interval: the minimal time in seconds between checkpoints
+        """
+        self._model = model
+        self._model_id = model_id
+        self._task_id = task_id
+        self._dataset_key = dataset_key
+        self._deliveries = deliveries
+        self._losses = {name: [] if loss is None else list(loss) for name, loss in losses.items()}
+        self._progress_interval = progress_interval
+        self._checkpoint_interval = checkpoint_interval
+        self._last_progress = -np.inf
+        self._last_checkpoint = time.monotonic()
+        self.cancelled = False
+
+    def __call__(self, progress: dict) -> bool:
+        for name, loss in self._losses.items():
+            if progress[name] is not None:
+                loss.append(progress[name])
+
+        now = time.monotonic()
+        last_stage = progress['stage'] >= progress['n_estimators']
+        stop = False
+        if now - self._last_progress >= self._progress_interval or last_stage:
+            self._last_progress = now
+            events.publish(schemas.FitProgress(model_id=self._model_id, **progress).model_dump_json())
+            stop = self.cancelled = events.cancel_requested(self._model_id)
+        if not (last_stage or stop) and now - self._last_checkpoint >= self._checkpoint_interval:
+            self._last_checkpoint = now
+            self.checkpoint()
+        return stop
+
+    def checkpoint(self) -> None:
+        """Save the trees fitted so far with their running predictions and staged losses"""
+        artifacts.save_checkpoint(self._model_id, {
+            'task_id': self._task_id,
+            'dataset_key': self._dataset_key,
+            'deliveries': self._deliveries,
+            'model': self._model,
+            'fit_state': self._model.fit_state,
+            **{name: np.array(loss) if loss else None for name, loss in self._losses.items()},
+        })
+
+
+def _count_delivery(record: dict | None, model_id: uuid.UUID, task_id: str) -> int:
     """
-    Celery task for fitting the model.
+    Return the number of deliveries of the task counting the current one, given\\
+    the record saved by its last delivery, e.g. the checkpoint of a fit.
+
+    Raises:
+    -------
+    - RuntimeError: if the task was delivered more than FIT_MAX_DELIVERIES times,\\
+        e.g. its worker is killed for running out of memory every time
+    """
+    if record is None or record.get('task_id') != task_id:
+        return 1
+    deliveries = record.get('deliveries', 1) + 1
+    if deliveries > settings.FIT_MAX_DELIVERIES:
+        raise RuntimeError(f'The fit of model {model_id} lost its worker {deliveries - 1} times')
+    return deliveries
+
+
+def _publish_fit_failed(task_id: str, model_id: uuid.UUID) -> None:
+    """Publish the \'failed\' status of the fit task"""
+    events.publish(schemas.FitStatus(task_id=task_id, model_id=model_id, status='failed').model_dump_json())
+
+
+def _redelivered_checkpoint(model_id: uuid.UUID, task_id: str) -> dict | None:
+    """
+    Return the checkpoint of the fit task if the task was redelivered after\\
+    its worker was lost, with its \'deliveries\' counting the current one.
+
+    Raises:
+    -------
+    - RuntimeError: if the task was delivered more than FIT_MAX_DELIVERIES times,\\
+        e.g. its worker is killed for running out of memory every time
+    """
+    checkpoint = artifacts.load_checkpoint(model_id)
+    if checkpoint is None or checkpoint['task_id'] != task_id:
+        return None
+    try:
+        checkpoint['deliveries'] = _count_delivery(checkpoint, model_id, task_id)
+    except RuntimeError:
+        artifacts.remove_checkpoint(model_id)
+        raise
+    return checkpoint
+
+
+@celery.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def fit_model_task(self, uuid_task: uuid.UUID, warm_start: bool = False, size: str = 'large'):
+    """
+    Celery task for fitting the model. The partially fitted model is\\
+    checkpointed periodically, and if the worker is lost the task is\\
+    redelivered and resumes the fit from the last checkpoint, at most\\
+    FIT_MAX_DELIVERIES times. A cancelled fit stops after the current stage\\
+    and keeps the trees fitted so far. The \'failed\' status is published\\
+    if the fit fails.
 
     Parameters:
     -------
-    - model_item_deserialized: deserialized record from the \'ml_models\' table
+    - uuid_task: uuid of the model to fit
+    - warm_start: add trees to the already fitted model up to its n_estimators\\
+        instead of fitting from scratch
+    - size: size class of the fit, which defines its share of the node\'s cores,\\
+        see `scheduling.n_jobs`
     """
+    try:
+        return _fit_model(self.request.id, uuid_task, warm_start, size)
+    except Exception:
+        _publish_fit_failed(self.request.id, uuid_task)
+        raise
+
+
+def _fit_model(task_id: str, uuid_task: uuid.UUID, warm_start: bool, size: str) -> str:
+    """Fit the model in the fit task, see `fit_model_task`. Returns the published status"""
     db = next(get_db())
     model_db_item = crud.read_model_item(db, uuid=uuid_task)
     model_item_deserialized = utils.deserialize(model_db_item)
 
     ensemble_params = model_item_deserialized['ensemble_params']
     tree_params = model_item_deserialized['tree_params']
-    target_name = model_item_deserialized['target_name']
     model_type = model_item_deserialized['model_type']
+    dataset_key = _dataset_key(model_item_deserialized)
+    # models grown with warm start depend on their previous fits
+    cache_key = None if warm_start else fit_cache.fit_key(model_db_item)
 
-    if model_type == schemas.ModelType.random_forest:
+    checkpoint = _redelivered_checkpoint(uuid_task, task_id)
+    resume = checkpoint is not None and checkpoint['dataset_key'] == dataset_key
+
+    n_jobs = scheduling.n_jobs(size)
+    warm_start = resume or (warm_start and model_item_deserialized['model_deserialized'] is not None)
+    losses = dict.fromkeys(['train_loss', 'val_loss', 'oob_loss'])
+    if resume:
+        model = checkpoint['model']
+        model.fit_state = checkpoint['fit_state']
+        losses = {name: checkpoint[name] for name in losses}
+    elif warm_start:
+        model = model_item_deserialized['model_deserialized']
+        model.fit_state = utils.load_fit_state(uuid_task, dataset_key)
+        losses = {name: model_item_deserialized[name] for name in losses}
+    elif model_type == schemas.ModelType.random_forest:
         model = RandomForestMSE(
             **ensemble_params,
             **tree_params,
+            n_jobs=n_jobs,
+            backend=settings.ENSEMBLE_BACKEND,
         )
     else:
         model = GradientBoostingMSE(
             **ensemble_params,
             **tree_params,
+            n_jobs=n_jobs,
+            backend=settings.ENSEMBLE_BACKEND,
         )
+    if warm_start:
+        model.n_estimators = ensemble_params['n_estimators']
+        model.n_jobs = n_jobs
 
-    # parse train data
-    train_data = pd.read_csv(model_item_deserialized['train_dataset_file_path'])
-    X_train = train_data.drop(target_name, axis=1).to_numpy()
-    y_train = train_data[target_name].to_numpy()
+    X_train, y_train, X_val, y_val = _load_fit_data(model_item_deserialized)
 
-    # parse val data if present
-    X_val, y_val = None, None
-    if model_item_deserialized['val_dataset_file_path'] is not None:
-        val_data = pd.read_csv(model_item_deserialized['val_dataset_file_path'])
-        X_val = val_data.drop(target_name, axis=1).to_numpy()
-        y_val = val_data[target_name].to_numpy()
+    # quantized features are cached alongside the stored dataset
+    fit_params = {}
+    train_path = model_item_deserialized['train_dataset_file_path']
+    if ensemble_params.get('tree_method') == schemas.TreeMethod.hist and os.path.isdir(train_path):
+        fit_params['binned'] = datasets.binned_features(train_path, ensemble_params['max_bins'])
 
     # fit the model and save it to the database
-    train_loss, val_loss = model.fit(X_train, y_train, X_val, y_val)
+    monitor = _FitMonitor(
+        model, model_db_item.id, task_id, dataset_key,
+        1 if checkpoint is None else checkpoint['deliveries'], losses,
+        settings.FIT_PROGRESS_INTERVAL_S, settings.FIT_CHECKPOINT_INTERVAL_S,
+    )
+    try:
+        # the delivery is counted before fitting, so a fit whose worker is lost
+        # before the first periodic checkpoint is not redelivered endlessly either
+        monitor.checkpoint()
+        train_loss, val_loss = model.fit(
+            X_train, y_train, X_val, y_val,
+            warm_start=warm_start,
+            callback=monitor,
+            **fit_params,
+        )
+        oob_loss = model.oob_loss if model_type == schemas.ModelType.random_forest else None
+        train_loss = _extend_loss(losses['train_loss'], train_loss)
+        val_loss = _extend_loss(losses['val_loss'], val_loss)
+        oob_loss = _extend_loss(losses['oob_loss'], oob_loss)
+        return _save_fit(
+            db, uuid_task, model, dataset_key,
+            cache_key=None if monitor.cancelled else cache_key,
+            train_loss=train_loss, val_loss=val_loss, oob_loss=oob_loss,
+        )
+    finally:
+        # the checkpoint is only needed if the worker is lost in the middle of the fit
+        artifacts.remove_checkpoint(uuid_task)
+        events.clear_cancel(uuid_task)
 
-    model_db_item = crud.update_model(db, uuid_task, model=model, train_loss=train_loss, val_loss=val_loss)
 
-    model_status = schemas.ModelStatusElement(
-        id=model_db_item.id,
-        model_name=model_db_item.model_name,
-        is_trained=model_db_item.is_trained,
-        target_name=model_db_item.target_name,
-    ).model_dump_json()
+@celery.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def fit_shard_task(self, uuid_task: uuid.UUID, shard: int, n_shards: int, entropy: int) -> int:
+    """
+    Celery task fitting a shard of the trees of a random forest, which is\\
+    merged with the other shards by `merge_shards_task`. Every shard draws\\
+    its trees from its own random stream spawned from the entropy, and stops\\
+    when the fit is cancelled. A shard of a lost worker is fitted again, at\\
+    most FIT_MAX_DELIVERIES times. The \'failed\' status is published if\\
+    the shard fails, and the shards are not merged, see `fit_shards_failed_task`.
 
-    return model_status
+    Parameters:
+    -------
+    - uuid_task: uuid of the model to fit
+    - shard: number of the shard
+    - n_shards: the number of shards the trees are split into
+    - entropy: seed of the whole forest
+
+    Returns:
+    -------
+    - number of the shard, saved to the artifact store
+    """
+    try:
+        return _fit_shard(self.request.id, uuid_task, shard, n_shards, entropy)
+    except Exception:
+        artifacts.remove_shards(uuid_task, [shard])
+        _publish_fit_failed(self.request.id, uuid_task)
+        raise
+
+
+def _fit_shard(task_id: str, uuid_task: uuid.UUID, shard: int, n_shards: int, entropy: int) -> int:
+    """Fit the shard in the shard task, see `fit_shard_task`. Returns number of the shard"""
+    # the shard is saved when its fit starts, so its deliveries are counted
+    deliveries = _count_delivery(artifacts.load_shard(uuid_task, shard), uuid_task, task_id)
+    artifacts.save_shard(uuid_task, shard, {'task_id': task_id, 'deliveries': deliveries})
+
+    db = next(get_db())
+    model_db_item = crud.read_model_item(db, uuid=uuid_task)
+    model_item_deserialized = utils.deserialize(model_db_item, load_model=False)
+
+    ensemble_params = dict(model_item_deserialized['ensemble_params'])
+    ensemble_params['n_estimators'] = scheduling.shard_size(ensemble_params['n_estimators'], shard, n_shards)
+    # the random state of the tree parameters seeds the forest
+    tree_params = dict(model_item_deserialized['tree_params'])
+    tree_params['random_state'] = np.random.SeedSequence(entropy, spawn_key=(shard,))
+    model = RandomForestMSE(
+        **ensemble_params,
+        **tree_params,
+        n_jobs=scheduling.n_jobs('large'),
+        backend=settings.ENSEMBLE_BACKEND,
+    )
+
+    X_train, y_train, X_val, y_val = _load_fit_data(model_item_deserialized)
+    model.fit(
+        X_train, y_train, X_val, y_val,
+        callback=lambda progress: events.cancel_requested(model_db_item.id),
+    )
+    artifacts.save_shard(uuid_task, shard, {'model': model})
+    return shard
+
+
+@celery.task
+def fit_shards_failed_task(request, exc, traceback, uuid_task: uuid.UUID, n_shards: int) -> None:
+    """
+    Error callback of the shards of a random forest, called instead of\\
+    `merge_shards_task` when a shard fails. The shards still running are\\
+    cancelled, and the fitted shards are removed.
+
+    Parameters:
+    -------
+    - request, exc, traceback: request and exception of the failed shard
+    - uuid_task: uuid of the fitted model
+    - n_shards: the number of shards the trees are split into
+    """
+    events.request_cancel(uuid_task)
+    artifacts.remove_shards(uuid_task, list(range(n_shards)))
+
+
+@celery.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def merge_shards_task(self, shards: list[int], uuid_task: uuid.UUID) -> str:
+    """
+    Celery task merging the fitted shards of a random forest into one model\\
+    and saving it, see `RandomForestMSE.merge`. The merge predicts every tree\\
+    on the train data, so it runs on the large workers with the share of the\\
+    cores of a large job. The \'failed\' status is published if the merge fails.
+
+    Parameters:
+    -------
+    - shards: numbers of the fitted shards
+    - uuid_task: uuid of the fitted model
+    """
+    try:
+        db = next(get_db())
+        model_db_item = crud.read_model_item(db, uuid=uuid_task)
+        model_item_deserialized = utils.deserialize(model_db_item, load_model=False)
+
+        shard_models = [artifacts.load_shard(uuid_task, shard)['model'] for shard in sorted(shards)]
+        for model in shard_models:
+            model.n_jobs = scheduling.n_jobs('large')
+        X_train, y_train, X_val, y_val = _load_fit_data(model_item_deserialized)
+        model, train_loss, val_loss = RandomForestMSE.merge(shard_models, X_train, y_train, X_val, y_val)
+        # shards of a cancelled fit stop early, so the forest is not cached
+        cancelled = events.cancel_requested(model_db_item.id)
+        return _save_fit(
+            db, uuid_task, model, _dataset_key(model_item_deserialized),
+            cache_key=None if cancelled else fit_cache.fit_key(model_db_item),
+            train_loss=train_loss, val_loss=val_loss, oob_loss=model.oob_loss,
+        )
+    except Exception:
+        _publish_fit_failed(self.request.id, uuid_task)
+        raise
+    finally:
+        artifacts.remove_shards(uuid_task, shards)
+        events.clear_cancel(uuid_task)
+
+
+@celery.task(bind=True)
+def predict_model_task(self, uuid_task: uuid.UUID, test_file_path: str, preds_file_path: str):
+    """
+    Celery task for predicting a large test file in chunks of rows. The number\\
+    of predicted rows is published after every chunk, and the status when the\\
+    task finishes.
+
+    Parameters:
+    -------
+    - uuid_task: uuid of the trained model
+    - test_file_path: path of the uploaded test file, removed when the task finishes
+    - preds_file_path: path of the output file
+    """
+    def publish_status(status: str, n_rows: int) -> str:
+        message = schemas.PredictionStatus(
+            task_id=self.request.id,
+            model_id=uuid_task,
+            status=status,
+            n_rows=n_rows,
+            file_path=preds_file_path,
+        ).model_dump_json()
+        events.publish(message)
+        return message
+
+    db = next(get_db())
+    try:
+        model_db_item = crud.read_model_item(db, uuid=uuid_task)
+        model = utils.deserialize(model_db_item)['model_deserialized']
+        model.n_jobs = scheduling.n_jobs('small')
+        n_features = utils.n_features(model_db_item.train_dataset_file_path, model_db_item.target_name)
+
+        n_rows = utils.predict_to_file(
+            model,
+            utils.read_csv_chunks(test_file_path, settings.PREDICT_CHUNK_ROWS, n_features),
+            preds_file_path,
+            callback=lambda n_rows: publish_status('running', n_rows),
+        )
+    except Exception:
+        publish_status('failed', 0)
+        raise
+    finally:
+        os.remove(test_file_path)
+
+    return publish_status('done', n_rows)
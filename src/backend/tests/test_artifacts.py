@@ -0,0 +1,107 @@
+import os
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import artifacts
+import utils
+from ensembles import RandomForestMSE
+from model_cache import ModelCache
+
+
+@pytest.fixture
+def artifacts_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, 'ARTIFACTS_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_save_load_model(artifacts_dir):
+    rng = np.random.RandomState(0)
+    X, y = rng.normal(size=(100, 3)), rng.normal(size=100)
+    model = RandomForestMSE(n_estimators=3, max_depth=3, feature_subsample_size=1.0, n_jobs=1)
+    model.fit(X, y)
+    model_id = uuid.uuid4()
+
+    artifacts.save_model(model_id, 1, model)
+    artifacts.save_model(model_id, 2, model)
+    assert np.allclose(artifacts.load_model(model_id, 1).predict(X), model.predict(X))
+
+    artifacts.remove_model(model_id, 1)
+    assert sorted(path.name for path in (artifacts_dir / str(model_id)).iterdir()) == ['2.pkl']
+    artifacts.remove_model(model_id)
+    assert not (artifacts_dir / str(model_id)).exists()
+
+
+def test_checkpoint(artifacts_dir):
+    model_id = uuid.uuid4()
+    assert artifacts.load_checkpoint(model_id) is None
+
+    artifacts.save_checkpoint(model_id, {'task_id': 'a', 'train_loss': np.arange(3)})
+    artifacts.save_checkpoint(model_id, {'task_id': 'b', 'train_loss': np.arange(4)})
+    checkpoint = artifacts.load_checkpoint(model_id)
+    assert checkpoint['task_id'] == 'b'
+    assert np.array_equal(checkpoint['train_loss'], np.arange(4))
+
+    artifacts.remove_checkpoint(model_id)
+    artifacts.remove_checkpoint(model_id)
+    assert artifacts.load_checkpoint(model_id) is None
+
+
+class _Record(SimpleNamespace):
+    @property
+    def model_serialized(self):
+        raise AssertionError('the serialized model must not be loaded')
+
+
+def test_deserialize_metadata_only():
+    record = _Record(
+        id=uuid.uuid4(),
+        model_name='forest',
+        model_type='random_forest',
+        model_parameters='{"ensemble_params": {"n_estimators": 3}}',
+        is_trained=True,
+        model_version=1,
+        train_dataset_file_path=None,
+        val_dataset_file_path=None,
+        train_loss=np.array([2.0, 1.0]).tobytes(),
+        val_loss=None,
+        oob_loss=None,
+        target_name='target',
+    )
+
+    params = utils.deserialize(record, load_model=False)
+
+    assert params['model_deserialized'] is None
+    assert np.array_equal(params['train_loss'], [2.0, 1.0])
+    assert params['ensemble_params'] == {'n_estimators': 3}
+
+
+def test_model_cache(artifacts_dir):
+    rng = np.random.RandomState(0)
+    X, y = rng.normal(size=(100, 3)), rng.normal(size=100)
+    model = RandomForestMSE(n_estimators=3, max_depth=3, feature_subsample_size=1.0, n_jobs=1)
+    model.fit(X, y)
+    records = [_Record(id=uuid.uuid4(), model_version=1) for _ in range(3)]
+    for record in records:
+        artifacts.save_model(record.id, 1, model)
+    size = os.path.getsize(artifacts.artifact_path(records[0].id, 1))
+    cache = ModelCache(max_bytes=2 * size)
+
+    first = cache.get_model(records[0])
+    assert cache.get_model(records[0]) is first
+    cache.get_model(records[1])
+    cache.get_model(records[0])
+    # the least recently used model is evicted
+    cache.get_model(records[2])
+    assert cache.stats()['evictions'] == 1
+    assert cache.get_model(records[0]) is first
+    assert cache.stats() == {
+        'hits': 3, 'misses': 3, 'evictions': 1, 'n_models': 2,
+        'size_bytes': 2 * size, 'max_bytes': 2 * size,
+    }
+
+    # a new version of the model is loaded again
+    cache.invalidate(records[0].id)
+    assert cache.get_model(records[0]) is not first
@@ -0,0 +1,63 @@
+import asyncio
+
+import numpy as np
+
+from batching import MicroBatcher
+
+
+class _CountingModel:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, X):
+        self.batch_sizes.append(X.shape[0])
+        if np.isnan(X).any():
+            raise ValueError('nan')
+        return X.sum(axis=1)
+
+
+def test_micro_batcher_coalesces_requests():
+    model = _CountingModel()
+    batcher = MicroBatcher(window=0.05, max_rows=100)
+    rows = [np.full((i + 1, 2), float(i)) for i in range(5)]
+
+    async def run():
+        return await asyncio.gather(*(batcher.predict('model', model, X) for X in rows))
+
+    preds = asyncio.run(run())
+
+    assert model.batch_sizes == [15]
+    for X, pred in zip(rows, preds):
+        assert np.array_equal(pred, X.sum(axis=1))
+
+
+def test_micro_batcher_max_rows():
+    model = _CountingModel()
+    batcher = MicroBatcher(window=10, max_rows=4)
+
+    async def run():
+        # a full batch does not wait for the window
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher.predict('model', model, np.ones((2, 3))) for _ in range(4))),
+            timeout=5,
+        )
+
+    preds = asyncio.run(run())
+
+    assert model.batch_sizes == [4, 4]
+    assert all(np.array_equal(pred, [3, 3]) for pred in preds)
+
+
+def test_micro_batcher_errors():
+    model = _CountingModel()
+    batcher = MicroBatcher(window=0.01, max_rows=100)
+
+    async def run():
+        good = batcher.predict('other', model, np.ones((1, 2)))
+        bad = batcher.predict('model', model, np.full((1, 2), np.nan))
+        return await asyncio.gather(good, bad, return_exceptions=True)
+
+    good, bad = asyncio.run(run())
+
+    assert np.array_equal(good, [2])
+    assert isinstance(bad, ValueError)
@@ -0,0 +1,36 @@
+import resource
+import time
+
+import numpy as np
+
+from ensembles import RandomForestMSE
+
+
+def peak_rss_mb() -> tuple:
+    """Return peak resident set size of this process and its finished children in MB"""
+    to_mb = 1 / 1024  # ru_maxrss is in kilobytes on linux
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * to_mb,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * to_mb,
+    )
+
+
+def test_random_forest_peak_rss(record_property):
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(100_000, 50))
+    y = X[:, 0] + rng.normal(size=100_000)
+
+    rss_before, _ = peak_rss_mb()
+    start = time.perf_counter()
+    model = RandomForestMSE(n_estimators=10, max_depth=6)
+    train_loss, _ = model.fit(X, y)
+    elapsed = time.perf_counter() - start
+    rss_self, rss_children = peak_rss_mb()
+
+    record_property('dataset_mb', X.nbytes / 2 ** 20)
+    record_property('fit_seconds', elapsed)
+    record_property('peak_rss_before_fit_mb', rss_before)
+    record_property('peak_rss_mb', rss_self)
+    record_property('peak_rss_children_mb', rss_children)
+
+    assert train_loss.shape[0] == 10
@@ -0,0 +1,127 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from datasets import (
+    csv_to_memmap, load_memmap, load_dataset, load_schema,
+    binned_features, column_stats, ingest_csv,
+)
+from histogram import HistogramBinner
+
+
+def test_csv_to_memmap(tmp_path):
+    rng = np.random.RandomState(0)
+    data = pd.DataFrame(rng.normal(size=(1000, 4)), columns=['a', 'b', 'target', 'c'])
+    csv_path = str(tmp_path / 'train.csv')
+    data.to_csv(csv_path, index=False)
+
+    X, y = load_memmap(csv_path, 'target')
+
+    assert isinstance(X, np.memmap)
+    assert X.dtype == np.float32 and X.flags['F_CONTIGUOUS']
+    assert np.allclose(X, data[['a', 'b', 'c']].to_numpy(), atol=1e-6)
+    assert np.allclose(y, data['target'].to_numpy())
+
+    # the dataset is converted only once
+    X_path, _ = csv_to_memmap(csv_path, 'target', chunksize=100)
+    mtime = (tmp_path / 'train.X.npy').stat().st_mtime_ns
+    assert csv_to_memmap(csv_path, 'target')[0] == X_path
+    assert (tmp_path / 'train.X.npy').stat().st_mtime_ns == mtime
+
+
+def test_csv_to_memmap_chunks(tmp_path):
+    data = pd.DataFrame({'x': np.arange(250), 'target': np.arange(250) * 2})
+    csv_path = str(tmp_path / 'train.csv')
+    data.to_csv(csv_path, index=False)
+
+    X_path, y_path = csv_to_memmap(csv_path, 'target', chunksize=100)
+
+    assert np.array_equal(np.load(X_path)[:, 0], np.arange(250))
+    assert np.array_equal(np.load(y_path), np.arange(250) * 2)
+
+
+def test_binned_features_cached(tmp_path):
+    rng = np.random.RandomState(0)
+    data = pd.DataFrame(rng.normal(size=(500, 3)), columns=['a', 'target', 'b'])
+    directory = str(tmp_path / 'dataset')
+    ingest_csv(io.BytesIO(data.to_csv(index=False).encode()), 'target', directory)
+
+    X_binned, bin_edges = binned_features(directory, max_bins=32)
+    mtime = (tmp_path / 'dataset' / 'X_binned_32_missing.npy').stat().st_mtime_ns
+
+    binner = HistogramBinner(32, subsample=None).fit(data[['a', 'b']].to_numpy())
+    assert np.array_equal(bin_edges, binner.bin_edges)
+    assert np.array_equal(X_binned, binner.transform(data[['a', 'b']].to_numpy()))
+
+    # the second call reads the cached arrays
+    X_binned_cached, bin_edges_cached = binned_features(directory, max_bins=32)
+    assert (tmp_path / 'dataset' / 'X_binned_32_missing.npy').stat().st_mtime_ns == mtime
+    assert np.array_equal(X_binned_cached, X_binned)
+    assert np.array_equal(bin_edges_cached, bin_edges)
+
+
+def test_column_stats(tmp_path):
+    data = pd.DataFrame({'x': [1.0, np.nan, 3.0], 'target': [0.0, 2.0, 4.0]})
+    directory = str(tmp_path / 'dataset')
+    ingest_csv(io.BytesIO(data.to_csv(index=False).encode()), 'target', directory)
+
+    stats = column_stats(directory)
+
+    assert stats['x'] == {'mean': 2.0, 'std': 1.0, 'min': 1.0, 'max': 3.0, 'n_missing': 1}
+    assert stats['target']['mean'] == 2.0
+    assert column_stats(directory) == stats
+
+
+def test_ingest_csv(tmp_path):
+    rng = np.random.RandomState(0)
+    data = pd.DataFrame(rng.normal(size=(250, 4)), columns=['a', 'target', 'b', 'c'])
+    data.iloc[3, 0] = np.nan
+    file = io.BytesIO(data.to_csv(index=False).encode())
+    directory = str(tmp_path / 'dataset')
+
+    schema = ingest_csv(file, 'target', directory, chunksize=100)
+    X, y = load_dataset(directory)
+
+    assert schema == load_schema(directory)
+    assert schema == {'target_name': 'target', 'columns': ['a', 'b', 'c'], 'n_rows': 250}
+    assert X.flags['F_CONTIGUOUS']
+    assert np.allclose(X, data[['a', 'b', 'c']].to_numpy(), atol=1e-6, equal_nan=True)
+    assert np.allclose(y, data['target'].to_numpy())
+    files = sorted(path.name for path in (tmp_path / 'dataset').iterdir())
+    assert files == ['X.npy', 'schema.json', 'stats.json', 'y.npy']
+
+    # statistics are collected during ingestion
+    stats = column_stats(directory)
+    assert stats['a']['n_missing'] == 1
+    for name in ['a', 'b', 'c', 'target']:
+        column = data[name].dropna()
+        assert np.isclose(stats[name]['mean'], column.mean())
+        assert np.isclose(stats[name]['std'], column.std(ddof=0))
+        assert np.isclose(stats[name]['min'], column.min()) and np.isclose(stats[name]['max'], column.max())
+
+
+def test_ingest_csv_existing(tmp_path):
+    data = pd.DataFrame({'a': [1.0, 2.0], 'target': [3.0, 4.0]})
+    directory = str(tmp_path / 'dataset')
+    ingest_csv(io.BytesIO(data.to_csv(index=False).encode()), 'target', directory)
+    X, _ = load_dataset(directory)
+
+    # the same dataset stored by a concurrent upload is kept as is
+    schema = ingest_csv(io.BytesIO(data.to_csv(index=False).encode()), 'target', directory)
+    assert schema == load_schema(directory)
+    assert np.array_equal(load_dataset(directory)[0], X)
+    assert [path.name for path in tmp_path.iterdir()] == ['dataset']
+
+
+@pytest.mark.parametrize('contents', [
+    b'a,b\n1,2\n',
+    b'a,target\n1,2\nx,3\n',
+    b'',
+])
+def test_ingest_csv_invalid(tmp_path, contents):
+    directory = tmp_path / 'dataset'
+    with pytest.raises(ValueError):
+        ingest_csv(io.BytesIO(contents), 'target', str(directory), chunksize=1)
+    assert list(tmp_path.iterdir()) == []
@@ -1,8 +1,12 @@
+import copy
+import pickle
+
 import numpy as np
 import pytest
 from sklearn.model_selection import train_test_split
 
 from ensembles import RandomForestMSE, GradientBoostingMSE
+from histogram import HistogramBinner
 
 np.random.seed(42)
 
@@ -266,3 +270,392 @@ def test_gradient_boosting_9():
     train_loss, val_loss = model.fit(X_train, y_train)
     assert val_loss is None
     assert train_loss.shape[0] == n_estimators
+
+
+def test_gradient_boosting_hist_1():
+    n_estimators = 10
+    model = GradientBoostingMSE(
+        n_estimators=n_estimators,
+        max_depth=5,
+        feature_subsample_size=None,
+        tree_method='hist',
+    )
+
+    train_loss, val_loss = model.fit(X_train, y_train, X_val, y_val)
+    assert len(model._models) == n_estimators
+    assert train_loss.shape[0] == n_estimators
+    assert val_loss.shape[0] == n_estimators
+
+    y_preds = model.predict(X_test)
+    assert y_preds.shape == y_test.shape
+
+
+def test_gradient_boosting_hist_2():
+    # features with less than max_bins unique values are binned without loss
+    rng = np.random.RandomState(0)
+    X_small = rng.randint(0, 50, size=(2000, 5)).astype(float)
+    y_small = X_small[:, 0] * 2 - X_small[:, 1] + rng.normal(size=2000)
+
+    losses = {}
+    for tree_method in ('exact', 'hist'):
+        np.random.seed(0)
+        model = GradientBoostingMSE(
+            n_estimators=20,
+            max_depth=3,
+            feature_subsample_size=1.0,
+            tree_method=tree_method,
+        )
+        losses[tree_method], _ = model.fit(X_small, y_small)
+
+    assert np.allclose(losses['exact'], losses['hist'], rtol=1e-2)
+
+
+def test_gradient_boosting_hist_missing_values():
+    rng = np.random.RandomState(0)
+    X_nan = rng.normal(size=(3000, 5))
+    y_nan = 3 * X_nan[:, 0] + X_nan[:, 1] + rng.normal(size=3000)
+    X_nan[rng.rand(3000) < 0.3, 0] = np.nan
+
+    # edges come from the present values, missing values get the last bin
+    binner = HistogramBinner(max_bins=32).fit(X_nan)
+    assert not np.isnan(binner.bin_edges).any()
+    assert np.all(np.diff(binner.bin_edges, axis=1)[np.isfinite(binner.bin_edges[:, 1:])] > 0)
+    assert np.array_equal(binner.transform(X_nan)[:, 0] == 32, np.isnan(X_nan[:, 0]))
+
+    losses = {}
+    for tree_method in ('exact', 'hist'):
+        model = GradientBoostingMSE(
+            n_estimators=20,
+            max_depth=4,
+            feature_subsample_size=1.0,
+            tree_method=tree_method,
+        )
+        losses[tree_method], _ = model.fit(X_nan, y_nan)
+        # staged losses are computed from the bins, predictions from the raw features
+        assert np.isclose(np.mean(np.square(model.predict(X_nan) - y_nan)), losses[tree_method][-1])
+
+    assert losses['hist'][-1] < 1.05 * losses['exact'][-1]
+
+
+def test_random_forest_compiled():
+    model = RandomForestMSE(
+        n_estimators=10,
+        max_depth=None,
+        feature_subsample_size=None,
+    )
+    model.fit(X_train, y_train)
+
+    expected = np.mean([model._run_estimator(X_test, estimator) for estimator in model._models], axis=0)
+    assert np.allclose(model.predict(X_test), expected)
+
+
+def test_gradient_boosting_compiled():
+    for tree_method in ('exact', 'hist'):
+        model = GradientBoostingMSE(
+            n_estimators=10,
+            max_depth=5,
+            feature_subsample_size=None,
+            tree_method=tree_method,
+        )
+        model.fit(X_train, y_train)
+
+        expected = np.sum([model._run_estimator(X_test, estimator) for estimator in model._models], axis=0)
+        assert np.allclose(model.predict(X_test), expected)
+
+
+def test_compiled_pickling():
+    model = GradientBoostingMSE(
+        n_estimators=10,
+        max_depth=5,
+        feature_subsample_size=None,
+    )
+    model.fit(X_train, y_train)
+
+    model_loaded = pickle.loads(pickle.dumps(model))
+    assert model_loaded._compiled is None
+    assert np.allclose(model_loaded.predict(X_test), model.predict(X_test))
+
+
+@pytest.mark.parametrize('model', [
+    RandomForestMSE(n_estimators=5, max_depth=5),
+    GradientBoostingMSE(n_estimators=5, max_depth=5),
+])
+def test_legacy_pickle(model):
+    model.fit(X_train, y_train)
+    expected = model.predict(X_test)
+    # models pickled before the attributes were added
+    for name in list(model._STATE_DEFAULTS):
+        del model.__dict__[name]
+
+    model_loaded = pickle.loads(pickle.dumps(model))
+    assert np.allclose(model_loaded.predict(X_test), expected)
+    model_loaded.n_estimators = 7
+    model_loaded.fit(X_train, y_train, warm_start=True)
+    assert model_loaded.n_estimators == 7 and len(model_loaded._models) == 7
+
+
+def test_staged_loss():
+    for model in (RandomForestMSE(n_estimators=10, max_depth=5),
+                  GradientBoostingMSE(n_estimators=10, max_depth=5)):
+        train_loss, val_loss = model.fit(X_train, y_train, X_val, y_val)
+
+        for X_, y_, loss in ((X_train, y_train, train_loss), (X_val, y_val, val_loss)):
+            staged_preds = np.cumsum([model._run_estimator(X_, estimator) for estimator in model._models], axis=0)
+            if isinstance(model, RandomForestMSE):
+                staged_preds /= (1 + np.arange(len(model._models)))[:, None]
+            assert np.allclose(loss, np.mean(np.square(staged_preds - y_), axis=1))
+
+
+def test_early_stopping():
+    n_estimators = 200
+    for model in (RandomForestMSE(n_estimators=n_estimators, max_depth=5, n_iter_no_change=3),
+                  GradientBoostingMSE(n_estimators=n_estimators, max_depth=5, n_iter_no_change=3)):
+        train_loss, val_loss = model.fit(X_train, y_train, X_val, y_val)
+
+        assert len(model._models) < n_estimators
+        assert train_loss.shape[0] == val_loss.shape[0] == len(model._models)
+        assert np.argmin(val_loss) == len(model._models) - 1
+
+
+def test_early_stopping_without_validation():
+    n_estimators = 10
+    model = GradientBoostingMSE(n_estimators=n_estimators, max_depth=5, n_iter_no_change=1)
+    train_loss, val_loss = model.fit(X_train, y_train)
+
+    assert val_loss is None
+    assert len(model._models) == n_estimators
+
+
+@pytest.mark.parametrize('backend', ['threads', 'processes', 'sequential'])
+def test_backends(backend):
+    n_estimators = 5
+    for model in (RandomForestMSE(n_estimators=n_estimators, max_depth=5, n_jobs=2, backend=backend),
+                  GradientBoostingMSE(n_estimators=n_estimators, max_depth=5, n_jobs=2, backend=backend)):
+        train_loss, _ = model.fit(X_train, y_train)
+        assert train_loss.shape[0] == len(model._models) == n_estimators
+
+        y_preds = model.predict(X_test)
+        assert y_preds.shape == y_test.shape
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        RandomForestMSE(n_estimators=10, backend='gpu')
+
+
+def test_random_forest_oob_loss():
+    n_estimators = 10
+    model = RandomForestMSE(n_estimators=n_estimators, max_depth=5)
+    train_loss, _ = model.fit(X_train, y_train)
+
+    assert model.oob_loss.shape == train_loss.shape
+    # trees are evaluated on unseen samples only, so the loss is not below the train one
+    assert model.oob_loss[-1] > train_loss[-1]
+
+
+def test_warm_start():
+    for model_cls in (RandomForestMSE, GradientBoostingMSE):
+        np.random.seed(0)
+        model_full = model_cls(n_estimators=10, max_depth=5, backend='sequential')
+        train_loss_full, val_loss_full = model_full.fit(X_train, y_train, X_val, y_val)
+
+        np.random.seed(0)
+        model = model_cls(n_estimators=5, max_depth=5, backend='sequential')
+        model.fit(X_train, y_train, X_val, y_val)
+        first_trees = list(model._models)
+
+        model.n_estimators = 10
+        train_loss, val_loss = model.fit(X_train, y_train, X_val, y_val, warm_start=True)
+
+        assert len(model._models) == 10
+        assert model._models[:5] == first_trees
+        assert np.allclose(train_loss, train_loss_full[5:])
+        assert np.allclose(val_loss, val_loss_full[5:])
+        assert np.allclose(model.predict(X_test), model_full.predict(X_test))
+
+
+def test_warm_start_after_pickling():
+    for model_cls in (RandomForestMSE, GradientBoostingMSE):
+        model = model_cls(n_estimators=5, max_depth=5)
+        model.fit(X_train, y_train, X_val, y_val)
+        expected_preds = model.fit_state['train_preds']
+
+        model = pickle.loads(pickle.dumps(model))
+        assert model.fit_state is None
+
+        # running predictions are restored from the fitted trees
+        assert np.allclose(model._resume_state(X_train, None)['train_preds'], expected_preds)
+
+        model.n_estimators = 8
+        train_loss, _ = model.fit(X_train, y_train, warm_start=True)
+        assert len(model._models) == 8
+        assert train_loss.shape[0] == 3
+
+
+def test_warm_start_fewer_estimators():
+    model = GradientBoostingMSE(n_estimators=5, max_depth=5)
+    model.fit(X_train, y_train)
+
+    model.n_estimators = 3
+    with pytest.raises(ValueError):
+        model.fit(X_train, y_train, warm_start=True)
+
+
+def test_memmap_dataset(tmp_path):
+    X_path = str(tmp_path / 'X.npy')
+    X_map = np.lib.format.open_memmap(X_path, mode='w+', dtype=np.float32, shape=X_train.shape, fortran_order=True)
+    X_map[:] = X_train
+    del X_map
+    X_map = np.load(X_path, mmap_mode='r')
+
+    for model in (RandomForestMSE(n_estimators=5, max_depth=5, backend='processes'),
+                  RandomForestMSE(n_estimators=5, max_depth=5),
+                  GradientBoostingMSE(n_estimators=5, max_depth=5),
+                  GradientBoostingMSE(n_estimators=5, max_depth=5, tree_method='hist')):
+        train_loss, _ = model.fit(X_map, y_train)
+        assert train_loss.shape[0] == 5
+        assert np.allclose(model.predict(X_map), model.predict(X_train))
+
+
+@pytest.mark.parametrize('tree_method', ['exact', 'hist'])
+def test_gradient_boosting_subsample(tree_method):
+    n_estimators = 10
+    model = GradientBoostingMSE(
+        n_estimators=n_estimators,
+        max_depth=5,
+        subsample=0.5,
+        tree_method=tree_method,
+    )
+    train_loss, val_loss = model.fit(X_train, y_train, X_val, y_val)
+
+    assert len(model._models) == n_estimators
+    assert val_loss.shape[0] == n_estimators
+    assert train_loss[-1] < train_loss[0]
+    # running predictions cover all the samples, not only the subsampled ones
+    assert np.isclose(train_loss[-1], np.mean(np.square(model.predict(X_train) - y_train)))
+
+
+def test_gradient_boosting_bad_subsample():
+    with pytest.raises(ValueError):
+        GradientBoostingMSE(n_estimators=10, subsample=0)
+
+
+@pytest.mark.parametrize('model', [
+    RandomForestMSE(n_estimators=10, max_depth=5),
+    GradientBoostingMSE(n_estimators=10, max_depth=3),
+])
+def test_fit_callback(model):
+    progress = []
+    train_loss, val_loss = model.fit(X_train, y_train, X_val, y_val, callback=progress.append)
+
+    assert [info['stage'] for info in progress] == list(range(1, 11))
+    assert all(info['n_estimators'] == 10 for info in progress)
+    assert np.allclose([info['train_loss'] for info in progress], train_loss)
+    assert np.allclose([info['val_loss'] for info in progress], val_loss)
+    assert np.all(np.diff([info['elapsed'] for info in progress]) >= 0)
+
+
+@pytest.mark.parametrize('model', [
+    RandomForestMSE(n_estimators=10, max_depth=5),
+    GradientBoostingMSE(n_estimators=10, max_depth=3),
+])
+def test_fit_callback_stop(model):
+    train_loss, _ = model.fit(X_train, y_train, callback=lambda info: info['stage'] == 4)
+
+    assert len(model._models) == 4
+    assert train_loss.shape[0] == 4
+    assert model.fit_state is not None
+
+
+@pytest.mark.parametrize('model', [
+    RandomForestMSE(n_estimators=10, max_depth=5),
+    GradientBoostingMSE(n_estimators=10, max_depth=3),
+])
+def test_fit_resume_from_checkpoint(model):
+    checkpoints = []
+
+    def checkpoint(info):
+        if info['stage'] == 4:
+            checkpoints.append((pickle.dumps(model), copy.deepcopy(model.fit_state)))
+
+    model.fit(X_train, y_train, X_val, y_val, callback=checkpoint)
+    resumed, fit_state = pickle.loads(checkpoints[0][0]), checkpoints[0][1]
+
+    # running predictions of the checkpoint are those of its trees
+    n_trees = len(resumed._models) if isinstance(resumed, RandomForestMSE) else 1
+    assert len(resumed._models) == 4
+    assert np.allclose(fit_state['train_preds'] / n_trees, resumed.predict(X_train))
+    assert np.allclose(fit_state['val_preds'] / n_trees, resumed.predict(X_val))
+
+    resumed.fit_state = fit_state
+    train_loss, val_loss = resumed.fit(X_train, y_train, X_val, y_val, warm_start=True)
+    assert len(resumed._models) == 10
+    assert train_loss.shape[0] == val_loss.shape[0] == 6
+
+
+def test_random_forest_random_state():
+    def fit_predict(random_state):
+        model = RandomForestMSE(n_estimators=5, max_depth=5, random_state=random_state)
+        model.fit(X_train, y_train)
+        return model.predict(X_test)
+
+    assert np.allclose(fit_predict(0), fit_predict(0))
+    assert not np.allclose(fit_predict(0), fit_predict(1))
+
+
+def test_random_forest_merge():
+    shards, losses = [], []
+    for shard, n_estimators in enumerate([4, 3, 3]):
+        model = RandomForestMSE(
+            n_estimators=n_estimators, max_depth=5,
+            random_state=np.random.SeedSequence(0, spawn_key=(shard,)),
+        )
+        train_loss, val_loss = model.fit(X_train, y_train, X_val, y_val)
+        shards.append(model)
+        losses.append((train_loss, val_loss, model.oob_loss))
+
+    merged, train_loss, val_loss = RandomForestMSE.merge(shards, X_train, y_train, X_val, y_val)
+
+    # shards draw different features for their trees
+    ftrs = [tuple(ftrs_subsample) for _, ftrs_subsample in merged._models]
+    assert len(set(ftrs)) == len(ftrs) == 10
+
+    # the first stages are the trees of the first shard
+    assert np.allclose(train_loss[:4], losses[0][0])
+    assert np.allclose(val_loss[:4], losses[0][1])
+    assert np.allclose(merged.oob_loss[:4], losses[0][2])
+
+    tree_preds = np.cumsum([estimator.predict(X_train[:, ftrs]) for estimator, ftrs in merged._models], axis=0)
+    staged_preds = tree_preds / np.arange(1, 11)[:, None]
+    assert np.allclose(train_loss, np.mean(np.square(staged_preds - y_train), axis=1))
+    assert merged.oob_loss.shape[0] == 10
+    assert np.isclose(val_loss[-1], np.mean(np.square(merged.predict(X_val) - y_val)))
+    for key in ['train_preds', 'val_preds', 'oob_preds', 'oob_counts']:
+        assert np.allclose(merged.fit_state[key], np.sum([shard.fit_state[key] for shard in shards], axis=0))
+
+    merged.n_estimators = 12
+    train_loss, _ = merged.fit(X_train, y_train, X_val, y_val, warm_start=True)
+    assert len(merged._models) == 12
+    assert train_loss.shape[0] == 2
+
+
+@pytest.mark.parametrize('model', [
+    RandomForestMSE(n_estimators=10, max_depth=6, feature_subsample_size=1.0),
+    GradientBoostingMSE(n_estimators=20, max_depth=4, feature_subsample_size=1.0),
+])
+def test_compiled_predict_missing_values(model):
+    rng = np.random.RandomState(0)
+    X_nan = rng.normal(size=(3000, 5))
+    y_nan = 3 * X_nan[:, 0] + X_nan[:, 1] + rng.normal(size=3000)
+    X_nan[rng.rand(3000) < 0.3, 0] = np.nan
+
+    train_loss, _ = model.fit(X_nan, y_nan)
+
+    if isinstance(model, RandomForestMSE):
+        tree_preds = np.mean([estimator.predict(X_nan[:, ftrs]) for estimator, ftrs in model._models], axis=0)
+    else:
+        tree_preds = np.sum([
+            alpha * estimator.predict(X_nan[:, ftrs]) for estimator, alpha, ftrs in model._models
+        ], axis=0)
+    assert np.allclose(model.predict(X_nan), tree_preds)
+    assert np.isclose(np.mean(np.square(model.predict(X_nan) - y_nan)), train_loss[-1])
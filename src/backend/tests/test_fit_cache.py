@@ -0,0 +1,79 @@
+import os
+import json
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import artifacts
+import fit_cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(fit_cache, 'FIT_CACHE_DIR', str(tmp_path / 'fit_cache'))
+    monkeypatch.setattr(artifacts, 'ARTIFACTS_DIR', str(tmp_path / 'models'))
+    return tmp_path / 'fit_cache'
+
+
+def _record(tmp_path, ensemble_params, val_dataset=True, **kwargs):
+    for name in ['train_hash', 'val_hash']:
+        os.makedirs(tmp_path / name, exist_ok=True)
+    return SimpleNamespace(
+        train_dataset_file_path=str(tmp_path / 'train_hash'),
+        val_dataset_file_path=str(tmp_path / 'val_hash') if val_dataset else None,
+        target_name='target',
+        model_type='random_forest',
+        model_parameters=json.dumps({'ensemble_params': ensemble_params, 'tree_params': {'random_state': None}}),
+        **kwargs,
+    )
+
+
+def test_fit_key(tmp_path):
+    key = fit_cache.fit_key(_record(tmp_path, {'n_estimators': 10, 'max_depth': 3}))
+
+    assert fit_cache.fit_key(_record(tmp_path, {'max_depth': 3, 'n_estimators': 10})) == key
+    assert fit_cache.fit_key(_record(tmp_path, {'n_estimators': 11, 'max_depth': 3})) != key
+    assert fit_cache.fit_key(_record(tmp_path, {'n_estimators': 10, 'max_depth': 3}, val_dataset=False)) != key
+
+    csv_record = _record(tmp_path, {'n_estimators': 10})
+    csv_record.train_dataset_file_path = str(tmp_path / 'train.csv')
+    assert fit_cache.fit_key(csv_record) is None
+
+
+def test_put_get(cache_dir, tmp_path):
+    model_file = tmp_path / 'model.pkl'
+    model_file.write_bytes(b'model')
+    assert fit_cache.get('key', max_age=60) is None
+
+    fit_cache.put('key', str(model_file), train_loss=np.arange(3.), val_loss=None, oob_loss=np.ones(3))
+    cached = fit_cache.get('key', max_age=60)
+    assert np.array_equal(cached['train_loss'], np.arange(3.))
+    assert cached['val_loss'] is None
+    assert np.array_equal(cached['oob_loss'], np.ones(3))
+
+    artifacts.copy_model(cached['model_file'], 'model_id', 1)
+    with open(artifacts.artifact_path('model_id', 1), 'rb') as file:
+        assert file.read() == b'model'
+
+    # expired fits are removed on access
+    os.utime(os.path.join(cache_dir, 'key', 'model.pkl'), (time.time() - 120, time.time() - 120))
+    assert fit_cache.get('key', max_age=60) is None
+    assert not os.path.exists(os.path.join(cache_dir, 'key'))
+
+
+def test_evict(cache_dir, tmp_path):
+    model_file = tmp_path / 'model.pkl'
+    model_file.write_bytes(b'0' * 1000)
+    for i, key in enumerate(['a', 'b', 'c']):
+        fit_cache.put(key, str(model_file), train_loss=np.zeros(3))
+        os.utime(os.path.join(cache_dir, key), (i, i))
+    # a hit makes the oldest fit the most recently used one
+    fit_cache.get('a', max_age=60)
+
+    fit_cache.evict(max_bytes=2 * 1500, max_age=60)
+    assert sorted(os.listdir(cache_dir)) == ['a', 'c']
+
+    fit_cache.evict(max_bytes=2 * 1500, max_age=0)
+    assert os.listdir(cache_dir) == []
@@ -0,0 +1,62 @@
+import io
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import scheduling
+from datasets import ingest_csv
+from settings import settings
+
+
+def test_estimate_cost(tmp_path):
+    data = pd.DataFrame(np.zeros((1000, 5)), columns=['a', 'b', 'c', 'd', 'target'])
+    ingest_csv(io.BytesIO(data.to_csv(index=False).encode()), 'target', str(tmp_path / 'dataset'))
+
+    assert scheduling.estimate_cost(str(tmp_path / 'dataset'), n_estimators=10) == 1000 * 4 * 10
+
+
+@pytest.mark.parametrize('budget, n_small, n_large', [(32, 2, 1), (32, 4, 3), (8, 2, 2), (2, 2, 1)])
+def test_n_jobs_fit_budget(monkeypatch, budget, n_small, n_large):
+    monkeypatch.setattr(settings, 'FIT_CPU_BUDGET', budget)
+    monkeypatch.setattr(settings, 'FIT_SMALL_CONCURRENCY', n_small)
+    monkeypatch.setattr(settings, 'FIT_LARGE_CONCURRENCY', n_large)
+
+    assert scheduling.n_jobs('small') == 1
+    assert scheduling.n_jobs('large') >= 1
+    if budget > n_small:
+        assert n_small * scheduling.n_jobs('small') + n_large * scheduling.n_jobs('large') <= budget
+
+
+def test_job_size(monkeypatch):
+    monkeypatch.setattr(settings, 'FIT_LARGE_MIN_COST', 1e6)
+
+    assert scheduling.job_size(1e5) == 'small'
+    assert scheduling.job_size(1e6) == 'large'
+
+
+@pytest.mark.parametrize('model_type, size, n_estimators, n_iter_no_change, expected', [
+    ('random_forest', 'large', 1000, None, 4),
+    ('random_forest', 'large', 120, None, 2),
+    ('random_forest', 'large', 1000, 5, 1),
+    ('random_forest', 'small', 1000, None, 1),
+    ('gradient_boosting', 'large', 1000, None, 1),
+])
+def test_n_shards(monkeypatch, model_type, size, n_estimators, n_iter_no_change, expected):
+    monkeypatch.setattr(settings, 'FIT_RF_SHARDS', 4)
+    monkeypatch.setattr(settings, 'FIT_RF_MIN_SHARD_TREES', 50)
+    model_db_item = SimpleNamespace(
+        model_type=model_type,
+        model_parameters=json.dumps({
+            'ensemble_params': {'n_estimators': n_estimators, 'n_iter_no_change': n_iter_no_change},
+        }),
+    )
+
+    assert scheduling.n_shards(model_db_item, size) == expected
+
+
+def test_shard_size():
+    sizes = [scheduling.shard_size(10, shard, 3) for shard in range(3)]
+    assert sizes == [4, 3, 3]
@@ -0,0 +1,91 @@
+import json
+import asyncio
+
+from sockets import ConnectionManager
+
+
+class _FakeWebSocket:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.sent = []
+        self.closed = None
+        self.client = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(message))
+
+    async def close(self, code):
+        self.closed = code
+
+
+def _progress(model_id, stage):
+    return json.dumps({'event': 'fit_progress', 'model_id': model_id, 'stage': stage})
+
+
+def test_subscriptions():
+    async def run():
+        manager = ConnectionManager()
+        everything, subscriber = _FakeWebSocket(), _FakeWebSocket()
+        await manager.connect(everything)
+        await manager.connect(subscriber, ['a'])
+
+        await manager.broadcast(json.dumps({'id': 'a', 'is_trained': True}))
+        await manager.broadcast(json.dumps({'id': 'b', 'is_trained': True}))
+        manager.subscribe(subscriber, ['b'])
+        manager.unsubscribe(subscriber, ['a'])
+        await manager.broadcast(json.dumps({'id': 'a', 'is_trained': False}))
+        await manager.broadcast(json.dumps({'id': 'b', 'is_trained': False}))
+        await asyncio.sleep(0.01)
+        return everything, subscriber
+
+    everything, subscriber = asyncio.run(run())
+
+    assert [message['id'] for message in everything.sent] == ['a', 'b', 'a', 'b']
+    assert subscriber.sent == [{'id': 'a', 'is_trained': True}, {'id': 'b', 'is_trained': False}]
+
+
+def test_slow_client():
+    async def run():
+        manager = ConnectionManager(max_queue=3)
+        fast, slow = _FakeWebSocket(), _FakeWebSocket(delay=10)
+        await manager.connect(fast)
+        await manager.connect(slow)
+
+        # progress messages are coalesced, status messages fill the queue of the slow client
+        for stage in range(10):
+            await manager.broadcast(_progress('a', stage))
+            await asyncio.sleep(0.001)
+        for i in range(5):
+            await manager.broadcast(json.dumps({'id': str(i)}))
+            await asyncio.sleep(0.001)
+        return manager, fast, slow
+
+    manager, fast, slow = asyncio.run(run())
+
+    assert [message.get('stage') for message in fast.sent] == [*range(10), *[None] * 5]
+    assert slow.sent == []
+    assert slow.closed == 1013
+    assert manager.active_connections == [fast]
+
+
+def test_coalescing():
+    async def run():
+        manager = ConnectionManager()
+        websocket = _FakeWebSocket(delay=0.01)
+        await manager.connect(websocket)
+
+        await manager.broadcast(_progress('a', 1))
+        await asyncio.sleep(0)  # the writer starts sending the first message
+        for stage in range(2, 6):
+            await manager.broadcast(_progress('a', stage))
+            await manager.broadcast(_progress('b', stage))
+        await asyncio.sleep(0.1)
+        return websocket
+
+    websocket = asyncio.run(run())
+
+    assert [(message['model_id'], message['stage']) for message in websocket.sent] == [('a', 1), ('a', 5), ('b', 5)]
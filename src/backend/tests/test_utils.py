@@ -0,0 +1,41 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+
+import utils
+
+
+class _SumModel:
+    def predict(self, X):
+        return X.sum(axis=1)
+
+
+def test_predict_to_file(tmp_path):
+    X = np.arange(500, dtype=np.float64).reshape(250, 2)
+    file = io.BytesIO(pd.DataFrame(X).to_csv(index=False).encode())
+    preds_file_path = str(tmp_path / 'preds.csv')
+    progress = []
+
+    n_rows = utils.predict_to_file(
+        _SumModel(), utils.read_csv_chunks(file, chunksize=100, n_features=2), preds_file_path, progress.append
+    )
+
+    assert n_rows == 250
+    assert progress == [100, 200, 250]
+    assert np.array_equal(np.loadtxt(preds_file_path), X.sum(axis=1))
+
+
+@pytest.mark.parametrize('contents', [b'a,b\n1,2\n3,4\n5,6\n', b'a,b,c\n1,2,x\n', b''])
+def test_predict_to_file_bad_file(tmp_path, contents):
+    with pytest.raises(HTTPException) as exc_info:
+        utils.predict_to_file(
+            _SumModel(),
+            utils.read_csv_chunks(io.BytesIO(contents), chunksize=2, n_features=3),
+            str(tmp_path / 'preds.csv'),
+        )
+
+    assert exc_info.value.status_code == 422
+    assert list(tmp_path.iterdir()) == []
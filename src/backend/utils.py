@@ -1,5 +1,9 @@
+import os
 import json
 import pickle
+import hashlib
+import functools
+from typing import BinaryIO, Callable, Iterator
 
 import pandas as pd
 import numpy as np
@@ -7,32 +11,116 @@ import numpy as np
 from fastapi import UploadFile, HTTPException
 
 import models
+import schemas
+import artifacts
+import datasets
 
 
-def validate_csv(file: UploadFile, target_name=None) -> pd.DataFrame:
+def read_csv_chunks(file: BinaryIO | str, chunksize: int, n_features: int | None = None) -> Iterator[np.ndarray]:
     """
-    Validates a csv file, uploaded via fastapi. Checks, that the file\\
-    can be opened and read by pandas, and checks if the target exists\\
-    in file, if target name is passed.
+    Read a csv file in chunks of rows. Checks, that every chunk can be\\
+    parsed by pandas, that all its columns are numeric and that the number\\
+    of columns is equal to n_features, if it is passed.
 
     Parameters:
     -------
-    - file: a .csv file to validate
-    - target_name: target column name to look for. If column with such name\\
-    is not found, an exception is raised
+    - file: a .csv file object or path to read
+    - chunksize: the number of rows in a chunk
+    - n_features: the expected number of columns
+
+    Returns:
+    -------
+    - iterator over arrays of size chunksize, n_features
     """
     try:
-        data = pd.read_csv(file.file)
-        file.file.close()
-        if target_name is not None:
-            _ = data[target_name]
-    except (pd.errors.ParserError, KeyError) as exc:
-        raise HTTPException(422, detail=f'Bad file format for file {file.filename}') from exc
+        for chunk in pd.read_csv(file, chunksize=chunksize):
+            if chunk.select_dtypes(exclude='number').shape[1] > 0:
+                raise ValueError('non-numeric columns')
+            if n_features is not None and chunk.shape[1] != n_features:
+                raise ValueError(f'expected {n_features} columns')
+            yield chunk.to_numpy()
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, ValueError) as exc:
+        raise HTTPException(422, detail=f'Bad file format: {exc}') from exc
+
 
-    return data
+def predict_to_file(model,
+                    chunks: Iterator[np.ndarray],
+                    preds_file_path: str,
+                    callback: Callable[[int], None] | None = None) -> int:
+    """
+    Predict chunks of rows one after another and append predictions to the\\
+    .csv file. The file is renamed into place when all chunks are predicted.
+
+    Parameters:
+    -------
+    - model: fitted ensemble
+    - chunks: iterator over arrays of size n_objects, n_features
+    - preds_file_path: path of the output file
+    - callback: function called with the number of predicted rows after every chunk
+
+    Returns:
+    -------
+    - the number of predicted rows
+    """
+    tmp_file_path = f'{preds_file_path}.tmp'
+    n_rows = 0
+    try:
+        with open(tmp_file_path, 'w', encoding='utf-8') as preds_file:
+            for X in chunks:
+                np.savetxt(preds_file, model.predict(X), delimiter=',')
+                n_rows += X.shape[0]
+                if callback is not None:
+                    callback(n_rows)
+    except BaseException:
+        os.remove(tmp_file_path)
+        raise
+    os.replace(tmp_file_path, preds_file_path)
+    return n_rows
 
 
-def deserialize(model_db_item: models.MLModel):
+def hash_upload(file: UploadFile, target_name: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Return sha256 hex digest of the uploaded file contents and the target name,\
+    which identifies the stored dataset. The file is read in chunks and rewound.
+
+    Parameters:
+    -------
+    - file: uploaded .csv file
+    - target_name: target column name
+    - chunk_size: the number of bytes read at once
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.file.read(chunk_size), b''):
+        digest.update(chunk)
+    digest.update(b'\0' + target_name.encode())
+    file.file.seek(0)
+    return digest.hexdigest()
+
+
+def dataset_out(dataset_hash: str, directory: str) -> schemas.DatasetOut:
+    """Return the summary of a stored dataset: its shape and column statistics"""
+    schema = datasets.load_schema(directory)
+    return schemas.DatasetOut(
+        hash=dataset_hash,
+        n_rows=schema['n_rows'],
+        columns=schema['columns'],
+        target_name=schema['target_name'],
+        column_stats=datasets.column_stats(directory),
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def n_features(dataset_path: str, target_name: str) -> int:
+    """
+    Return the number of features of the train dataset. Stored datasets\\
+    are addressed by contents and never change, so the result is cached.
+    """
+    if os.path.isdir(dataset_path):
+        return len(datasets.load_schema(dataset_path)['columns'])
+    return pd.read_csv(dataset_path, nrows=0).shape[1] - 1
+
+
+def deserialize(model_db_item: models.MLModel, load_model: bool = True):
     """
     Deserializes a record from the \'ml_models\' table.
 
@@ -40,16 +128,15 @@ def deserialize(model_db_item: models.MLModel):
     -------
     - model_db_item: a single-row result of a query to the\\
     \'ml_models\' table
+    - load_model: load the fitted model from the artifact store. If False,\\
+    only metadata is returned and \'model_deserialized\' is None
     """
     model_deserialized = None
-    train_loss_deserialized = None
-    val_loss_deserialized = None
-    if model_db_item.model_serialized is not None:
-        model_deserialized = pickle.loads(model_db_item.model_serialized)
-        if model_db_item.train_loss is not None:
-            train_loss_deserialized = np.frombuffer(model_db_item.train_loss)
-        if model_db_item.val_loss is not None:
-            val_loss_deserialized = np.frombuffer(model_db_item.val_loss)
+    if load_model:
+        if model_db_item.model_version is not None:
+            model_deserialized = artifacts.load_model(model_db_item.id, model_db_item.model_version)
+        elif model_db_item.model_serialized is not None:
+            model_deserialized = pickle.loads(model_db_item.model_serialized)
 
     model_out_params = {
         'uuid': model_db_item.id,
@@ -60,9 +147,57 @@ def deserialize(model_db_item: models.MLModel):
         'model_deserialized': model_deserialized,
         'train_dataset_file_path': model_db_item.train_dataset_file_path,
         'val_dataset_file_path': model_db_item.val_dataset_file_path,
-        'train_loss': train_loss_deserialized,
-        'val_loss': val_loss_deserialized,
+        'train_loss': _frombuffer(model_db_item.train_loss),
+        'val_loss': _frombuffer(model_db_item.val_loss),
+        'oob_loss': _frombuffer(model_db_item.oob_loss),
         'target_name': model_db_item.target_name,
     }
 
     return model_out_params
+
+
+def _frombuffer(buffer: bytes | None) -> np.ndarray | None:
+    """Deserialize a loss curve stored in the \'ml_models\' table"""
+    return None if buffer is None else np.frombuffer(buffer)
+
+
+def fit_state_path(uuid) -> str:
+    """Return path of the file with running predictions of the model\'s last fit"""
+    return f'storage/fit_state/{uuid}.npz'
+
+
+def save_fit_state(uuid, fit_state: dict | None, dataset_key: str) -> None:
+    """
+    Save running predictions of the model\'s last fit, so the model can be\
+    warm started without a prediction pass.
+
+    Parameters:
+    -------
+    - uuid: uuid of the model
+    - fit_state: `fit_state` of the fitted ensemble. If None, the saved state is removed
+    - dataset_key: identifier of the train and validation data the model was fit on
+    """
+    path = fit_state_path(uuid)
+    if fit_state is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {key: value for key, value in fit_state.items() if value is not None}
+    np.savez(path, dataset_key=np.array(dataset_key), **arrays)
+
+
+def load_fit_state(uuid, dataset_key: str) -> dict | None:
+    """
+    Load running predictions of the model\'s last fit. Returns None if there\
+    is no saved state or it was computed on other data.
+    """
+    path = fit_state_path(uuid)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as saved:
+        if str(saved['dataset_key']) != dataset_key:
+            return None
+        return {key: saved[key] for key in saved.files if key != 'dataset_key'}
@@ -1,7 +1,14 @@
 from celery import Celery
 
+from settings import settings
+
 
 celery = Celery(__name__)
 celery.autodiscover_tasks(['tasks'])
-celery.conf.broker_url = "redis://redis:6379"
-celery.conf.result_backend = "redis://redis:6379"
+celery.conf.broker_url = settings.REDIS_URL
+celery.conf.result_backend = settings.REDIS_URL
+# fits are long, a worker takes the next task only when it has a free slot
+celery.conf.worker_prefetch_multiplier = 1
+# fits are acknowledged when they finish, so fits of a killed worker are redelivered
+# and resume from their checkpoint, unacknowledged tasks are redelivered after the timeout
+celery.conf.broker_transport_options = {'visibility_timeout': settings.FIT_VISIBILITY_TIMEOUT_S}